@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+import config
+from db_utils import ConnectionPool, default_db_dir
+from http_client import is_unavailable
+from metrics_utils import increment
+
+
+def content_hash(*parts):
+    """バイト列・文字列からキャッシュのキーとなるハッシュ値を作成する関数
+
+    Args:
+        *parts: ハッシュ化するバイト列または文字列
+
+    Returns:
+        str: SHA-256のハッシュ値（16進数）
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(part)
+        #区切りを入れて連結の曖昧さをなくす
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """サーバーの応答をキーごとに保持するキャッシュ
+
+    メモリ上では最大件数を超えたものから古い順に破棄し、有効期限を過ぎたものは返さない。
+    有効期限を過ぎたものもstale_ttl秒の間は残し、サーバーに接続できない場合に返す。
+    db_pathを指定した場合はSQLiteにも保存し、プロセスの再起動後も利用できる。
+    値はJSONとして保持するため、取得した値を変更してもキャッシュには影響しない。
+
+    Attributes:
+        name (str): キャッシュ名（SQLiteのテーブル名）
+        max_entries (int): 保持する最大件数
+        ttl (float): 有効期限の秒数
+        stale_ttl (float): 有効期限が切れた後も縮退運転用に残す秒数
+    """
+    def __init__(self, name, max_entries=256, ttl=24 * 60 * 60, db_path=None, stale_ttl=0):
+        """初期化メソッド
+
+        Args:
+            name (str): キャッシュ名（SQLiteのテーブル名）
+            max_entries (int): 保持する最大件数
+            ttl (float): 有効期限の秒数
+            db_path (str): 保存先のSQLiteのパス。Noneの場合はメモリのみ
+            stale_ttl (float): 有効期限が切れた後も縮退運転用に残す秒数
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.pool = ConnectionPool.get(db_path) if db_path else None
+        if self.pool:
+            with self.pool.connection() as conn:
+                conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.name}(
+                                key TEXT PRIMARY KEY,
+                                value TEXT,
+                                expires_at REAL
+                                )''')
+
+    def get(self, key, stale=False):
+        """キャッシュされた値を取得するメソッド
+
+        Args:
+            key (str): キー
+            stale (bool): Trueの場合は有効期限が切れてから stale_ttl 秒以内の値も返す
+
+        Returns:
+            obj: キャッシュされた値。ない場合や期限切れの場合はNone
+        """
+        now = time.time()
+        #有効期限がこの時刻より後の値を返す
+        since = now - self.stale_ttl if stale else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > since:
+                    self._entries.move_to_end(key)
+                    return json.loads(value)
+                if expires_at + self.stale_ttl <= now:
+                    del self._entries[key]
+
+        if self.pool:
+            row = self.pool.connection().execute(
+                f"SELECT value, expires_at FROM {self.name} WHERE key = ? AND expires_at > ?", (key, since)
+            ).fetchone()
+            if row is not None:
+                self._remember(key, row["value"], row["expires_at"])
+                return json.loads(row["value"])
+        return None
+
+    def set(self, key, value):
+        """値をキャッシュするメソッド
+
+        Args:
+            key (str): キー
+            value (obj): JSONに変換できる値
+        """
+        value = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+
+        if self.pool:
+            with self.pool.connection() as conn:
+                conn.execute(f"INSERT OR REPLACE INTO {self.name} (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, value, expires_at))
+                #縮退運転用に残す期間も過ぎたものと最大件数を超えた古いものを削除
+                conn.execute(f'''DELETE FROM {self.name} WHERE expires_at <= ? OR key NOT IN
+                                (SELECT key FROM {self.name} ORDER BY expires_at DESC LIMIT ?)''',
+                             (time.time() - self.stale_ttl, self.max_entries))
+
+    def fallback(self, key, error):
+        """サーバーに接続できない場合に、有効期限の切れたものも含めてキャッシュされた値を返すメソッド
+
+        Args:
+            key (str): キー
+            error (Exception): サーバーへのリクエストで送出された例外
+
+        Returns:
+            obj: キャッシュされた値
+
+        Raises:
+            Exception: 縮退運転が無効な場合、サーバーに接続できないことによる例外でない場合、
+                またはキャッシュがない場合はerrorを送出し直す
+        """
+        if config.degraded_mode and is_unavailable(error):
+            value = self.get(key, stale=True)
+            if value is not None:
+                increment(f"{self.name}_degraded")
+                return value
+        raise error
+
+    def invalidate(self, key):
+        """指定したキーのキャッシュを破棄するメソッド
+
+        Args:
+            key (str): キー
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.pool:
+            with self.pool.connection() as conn:
+                conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+
+    def _remember(self, key, value, expires_at):
+        """メモリ上のキャッシュに値を追加するメソッド
+
+        Args:
+            key (str): キー
+            value (str): JSON文字列
+            expires_at (float): 有効期限のUNIX時刻
+        """
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def cache_db_path():
+    """キャッシュを保存するSQLiteのパスを取得する関数
+
+    Returns:
+        str: SQLiteのパス
+    """
+    return os.path.join(default_db_dir(), "cache.db")
+
+
+class SingleFlight:
+    """同じキーの処理が実行中の場合、その結果を待って共有するクラス
+
+    同時に届いた同一のリクエストをまとめ、サーバーへの呼び出しを一回にする
+    """
+    def __init__(self):
+        """初期化メソッド"""
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """キーごとに一回だけfnを実行し、その結果を返すメソッド
+
+        Args:
+            key (str): キー
+            fn (callable): 実行する処理
+
+        Returns:
+            obj: fnの戻り値（fnが例外を送出した場合は同じ例外を送出する）
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except CancelledError:
+                #先に実行していたストリーミングが途中で中断された場合は、改めて実行する
+                continue
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._leave(key, future)
+        return future.result()
+
+    def stream(self, key, fn, collect=list, split=iter):
+        """キーごとに一回だけfnを実行し、その要素を順に返すメソッド
+
+        最初の呼び出しはfnが返す要素を受け取った順に返し、すべて受け取った後にcollectでまとめて共有する。
+        実行中に同じキーで呼び出した場合は、doで実行中の場合も含め、結果がそろうまで待ってからsplitで要素に分けて返す。
+
+        Args:
+            key (str): キー
+            fn (callable): 要素を順に返すイテレータを作成する処理
+            collect (callable): 要素のリストから共有する結果を作成する関数
+            split (callable): 共有された結果を要素に分ける関数
+
+        Yields:
+            obj: fnが返す要素
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                result = future.result()
+            except CancelledError:
+                continue
+            yield from split(result)
+            return
+
+        items = []
+        try:
+            for item in fn():
+                items.append(item)
+                yield item
+        except GeneratorExit:
+            #途中で読み込みをやめた場合は、待っている呼び出しに改めて実行させる
+            self._leave(key, future)
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(collect(items))
+        finally:
+            self._leave(key, future)
+
+    def _join(self, key):
+        """キーの実行中の処理を取得し、なければ登録するメソッド
+
+        Args:
+            key (str): キー
+
+        Returns:
+            tuple: (結果を受け取るFuture, 自分が実行するかどうか)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _leave(self, key, future):
+        """実行が終わった処理の登録を削除するメソッド
+
+        Args:
+            key (str): キー
+            future (Future): 削除する処理のFuture
+        """
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
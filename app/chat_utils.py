@@ -1,9 +1,12 @@
-import requests
 import json
+import requests
 from pydantic import BaseModel
 from typing import List
 import streamlit as st
 import config
+from http_client import get_client
+from cache_utils import ResultCache, SingleFlight, content_hash
+from metrics_utils import timed, increment
 
 class Ingredient(BaseModel):
     食材: str
@@ -15,14 +18,82 @@ class Ingredients(BaseModel):
     目的: str
 
 
+# 食材リストと目的をキーとした料理提案のキャッシュ（全セッションで共有）
+proposal_cache = ResultCache(
+    "proposal_cache",
+    max_entries=config.proposal_cache_size,
+    ttl=config.proposal_cache_ttl,
+    stale_ttl=config.degraded_cache_ttl,
+)
+_proposal_flight = SingleFlight()
+
+# ストリーミング応答として受け付けるContent-Type
+STREAM_ACCEPT = "application/x-ndjson, text/event-stream;q=0.9, application/json;q=0.5"
+
+
+def split_dishes(data):
+    """応答データから料理のリストを取り出す関数
+
+    Args:
+        data (dict): 料理一件、または"Dishes"に料理のリストを持つ応答データ
+
+    Returns:
+        list: 料理のリスト
+    """
+    if "Dishes" in data:
+        return data["Dishes"]
+    return [data]
+
+
 class DishProposer():
     def __init__(self):
         self.server_url = "http://" + config.server_ip + "/propose_dish/"
     
+    @timed("dish_proposal")
     def proposal(self,ingredients):
-        response = self.upload(ingredients)
+        """料理を提案するメソッド
+
+        同じ食材リストと目的の提案はキャッシュから返し、
+        同時に同じ内容のリクエストがあった場合はサーバーへの呼び出しを共有する
+
+        Args:
+            ingredients (Ingredients): 食材リストと目的
+
+        Returns:
+            dict: サーバーからの応答データ
+        """
+        key = self.cache_key(ingredients)
+        response = proposal_cache.get(key)
+        increment("proposal_cache_miss" if response is None else "proposal_cache_hit")
+        if response is not None:
+            return response
+
+        try:
+            response = _proposal_flight.do(key, lambda: self.upload(ingredients))
+        except requests.RequestException as e:
+            #サーバーに接続できない場合は期限切れの提案を返す
+            return proposal_cache.fallback(key, e)
+        if isinstance(response, dict) and "Dishes" in response:
+            proposal_cache.set(key, response)
         return response
 
+    def cache_key(self, ingredients):
+        """食材リストの順番に依存しないキャッシュのキーを作成するメソッド
+
+        食材が追加・削除されるとキーが変わるため、古い提案は使われない
+
+        Args:
+            ingredients (Ingredients): 食材リストと目的
+
+        Returns:
+            str: キャッシュのキー
+        """
+        data = ingredients.dict()
+        data["食材リスト"] = sorted(
+            data["食材リスト"], key=lambda x: (x["食材"], x["期限種類"], x["期限"])
+        )
+        return content_hash(json.dumps(data, ensure_ascii=False, sort_keys=True))
+
     def upload(self, data):
         """食材リストをアップロードするメソッド
 
@@ -30,9 +101,74 @@ class DishProposer():
             dict: サーバーからの応答データ。エラーが発生した場合はNone
         """
 
-        response = requests.post(self.server_url, 
+        response = get_client().post("propose_dish", self.server_url, 
                                     data=json.dumps(data.dict()),
                                     headers = {'Content-Type': 'application/json'} 
         )
         response_data = response.json()
         return response_data
+
+    def stream(self, ingredients):
+        """料理の提案を受け取った順に返すメソッド
+
+        キャッシュがある場合はキャッシュから返し、すべて受け取った後にキャッシュする。
+        proposalと同じキーでサーバーへの呼び出しを共有し、実行中の場合はその結果がそろうまで待って返す。
+        サーバーに接続できない場合は期限切れのキャッシュから返す
+
+        Args:
+            ingredients (Ingredients): 食材リストと目的
+
+        Yields:
+            dict: 料理一件分のデータ
+        """
+        key = self.cache_key(ingredients)
+        response = proposal_cache.get(key)
+        increment("proposal_cache_miss" if response is None else "proposal_cache_hit")
+        if response is not None:
+            yield from response["Dishes"]
+            return
+
+        dishes = []
+        try:
+            for dish in _proposal_flight.stream(key, lambda: self.upload_stream(ingredients),
+                                                collect=lambda items: {"Dishes": items}, split=split_dishes):
+                dishes.append(dish)
+                yield dish
+        except requests.RequestException as e:
+            #一件も受け取っていない場合だけ期限切れの提案に切り替える
+            if dishes:
+                raise
+            yield from proposal_cache.fallback(key, e)["Dishes"]
+            return
+        proposal_cache.set(key, {"Dishes": dishes})
+
+    def upload_stream(self, data):
+        """食材リストをアップロードし、応答を料理ごとに読み込むメソッド
+
+        NDJSON・SSEの応答は一行（一イベント）ごとに料理を返す。
+        サーバーがストリーミングに対応していない場合はJSONの応答全体を読み込んでから返す。
+
+        Yields:
+            dict: 料理一件分のデータ
+        """
+        response = get_client().post("propose_dish", self.server_url,
+                                    data=json.dumps(data.dict()),
+                                    headers = {'Content-Type': 'application/json', 'Accept': STREAM_ACCEPT},
+                                    stream=True
+        )
+        with response:
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+            if content_type == "application/x-ndjson":
+                for line in response.iter_lines():
+                    if line.strip():
+                        yield from split_dishes(json.loads(line.decode("utf-8")))
+            elif content_type == "text/event-stream":
+                for line in response.iter_lines():
+                    line = line.decode("utf-8")
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload and payload != "[DONE]":
+                        yield from split_dishes(json.loads(payload))
+            else:
+                yield from split_dishes(response.json())
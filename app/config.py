@@ -1,3 +1,74 @@
 
 import os 
-server_ip = os.environ["SERVER_IP"]
\ No newline at end of file
+# 推論サーバーの代わりにスタンドインサーバー（standin_server.py）をプロセス内で起動するかどうかと、注入する遅延秒数・失敗率
+standin_server = os.environ.get("STANDIN_SERVER", "0") == "1"
+standin_latency = float(os.environ.get("STANDIN_LATENCY", "0"))
+standin_failure_rate = float(os.environ.get("STANDIN_FAILURE_RATE", "0"))
+# スタンドインサーバーを使う場合、アドレスは起動時に設定する
+server_ip = os.environ.get("SERVER_IP", "") if standin_server else os.environ["SERVER_IP"]
+
+# アップロード前の画像縮小設定（長辺の最大ピクセル数。0の場合は縮小しない）
+upload_max_edge = int(os.environ.get("UPLOAD_MAX_EDGE", "1600"))
+# アップロード時の再エンコード形式（JPEG または WEBP）と品質
+upload_format = os.environ.get("UPLOAD_FORMAT", "JPEG").upper()
+upload_quality = int(os.environ.get("UPLOAD_QUALITY", "85"))
+
+# 推論サーバーへのリクエストの(接続, 読み込み)タイムアウト秒数とリトライ回数
+connect_timeout = float(os.environ.get("CONNECT_TIMEOUT", "3.05"))
+http_timeouts = {
+    "food-expiration": (connect_timeout, float(os.environ.get("DETECTION_TIMEOUT", "60"))),
+    "propose_dish": (connect_timeout, float(os.environ.get("PROPOSAL_TIMEOUT", "180"))),
+}
+http_retries = int(os.environ.get("HTTP_RETRIES", "2"))
+
+# 画像検出結果のキャッシュ設定（有効期限の秒数、最大件数、SQLiteへの保存の有無）
+detection_cache_ttl = float(os.environ.get("DETECTION_CACHE_TTL", str(24 * 60 * 60)))
+detection_cache_size = int(os.environ.get("DETECTION_CACHE_SIZE", "256"))
+detection_cache_persist = os.environ.get("DETECTION_CACHE_PERSIST", "0") == "1"
+
+# 料理提案のキャッシュ設定（有効期限の秒数、最大件数）
+proposal_cache_ttl = float(os.environ.get("PROPOSAL_CACHE_TTL", str(6 * 60 * 60)))
+proposal_cache_size = int(os.environ.get("PROPOSAL_CACHE_SIZE", "128"))
+# 料理提案をストリーミングで受け取るかどうか（サーバーが対応していない場合は通常の応答として扱う）
+proposal_stream = os.environ.get("PROPOSAL_STREAM", "1") == "1"
+
+# バックグラウンドで同時に処理する写真の数と、処理状況を確認する間隔の秒数
+job_workers = int(os.environ.get("JOB_WORKERS", "4"))
+job_poll_interval = float(os.environ.get("JOB_POLL_INTERVAL", "1"))
+# 完了したジョブの結果を、処理状況が確認されなくなってから保持する秒数（閉じられたセッションのジョブを破棄するため）
+job_result_ttl = float(os.environ.get("JOB_RESULT_TTL", "600"))
+
+# 複数枚の画像を一回のリクエストで送信するサーバーのパス（空の場合は一枚ずつ送信）と一回に送る最大枚数
+detection_batch_path = os.environ.get("DETECTION_BATCH_PATH", "")
+detection_batch_size = int(os.environ.get("DETECTION_BATCH_SIZE", "8"))
+
+# 商品画像の保存先（sqlite: 内容のハッシュ値で重複を除いてSQLiteに保存、directory: {ID}.pngのファイル）
+image_store = os.environ.get("IMAGE_STORE", "sqlite")
+image_store_format = os.environ.get("IMAGE_STORE_FORMAT", "WEBP").upper()
+image_store_quality = int(os.environ.get("IMAGE_STORE_QUALITY", "80"))
+# 削除で生じた空きページがこの割合以上になった場合に画像のDBを縮小する
+image_store_vacuum_ratio = float(os.environ.get("IMAGE_STORE_VACUUM_RATIO", "0.25"))
+
+# 画面の切り替え方法（radio: 選択中の画面だけを描画、tabs: 全てのタブを毎回描画）
+navigation = os.environ.get("NAVIGATION", "radio")
+
+# 処理時間の集計を返すHTTPサーバーのポート（0の場合は起動しない）と、再実行ごとの内訳をサイドバーに表示するかどうか
+metrics_port = int(os.environ.get("METRICS_PORT", "0"))
+debug_panel = os.environ.get("DEBUG_PANEL", "0") == "1"
+
+# 期限通知の送信先（空の場合は通知しない。log、file:<パス>、webhook:<URL>のいずれか）
+notify_sink = os.environ.get("NOTIFY_SINK", "")
+# 期限通知を送る時刻（時）と、期限切れの商品を通知し続ける日数
+notify_hour = int(os.environ.get("NOTIFY_HOUR", "8"))
+notify_expired_days = int(os.environ.get("NOTIFY_EXPIRED_DAYS", "7"))
+
+# セッションごとに保持する入力欄の最大数と、入力欄の画像の合計の最大バイト数
+input_max_rows = int(os.environ.get("INPUT_MAX_ROWS", "100"))
+input_max_image_bytes = int(os.environ.get("INPUT_MAX_IMAGE_BYTES", str(8 * 1024 * 1024)))
+
+# 推論サーバーに接続できない場合に有効期限の切れたキャッシュを返すかどうかと、期限切れ後も返す秒数
+degraded_mode = os.environ.get("DEGRADED_MODE", "1") == "1"
+degraded_cache_ttl = float(os.environ.get("DEGRADED_CACHE_TTL", str(7 * 24 * 60 * 60)))
+
+# 商品データを保存するDBファイルの数（1: ユーザと同じproduct.db、N: ユーザIDで振り分けるN個のファイル、0: ユーザごとに一つのファイル）
+db_shards = int(os.environ.get("DB_SHARDS", "1"))
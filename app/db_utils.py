@@ -1,54 +1,521 @@
 import sqlite3
 import os
+import re
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import config
+from metrics_utils import timed, increment
+from store_utils import DirectoryImageStore, SQLiteImageStore
+
+# 接続時に設定するPRAGMA
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA busy_timeout=5000",
+)
+# 接続ごとにキャッシュするプリペアドステートメントの数
+CACHED_STATEMENTS = 128
+# DBごとに、スレッドの終了後も再利用のため開いたままにしておく接続の最大数
+MAX_IDLE_CONNECTIONS = 4
+
+# 切り出し画像の保存をリクエストスレッド外で行うワーカー
+_image_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-writer")
+
+# 商品IDのうちシャード番号を表す上位ビットの位置（IDを右にシフトするとシャード番号になる）。
+# ブラウザ側で数値として扱えるよう、IDは2**53未満に収める
+SHARD_ID_BITS = 32
+# シャードのDBファイル名
+SHARD_FILE_PATTERN = re.compile(r"(?:user|shard)_(\d+)\.db")
+
+PRODUCT_TABLE = '''CREATE TABLE IF NOT EXISTS product( 
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_name VARCHAR(50),
+                item_name VARCHAR(50),
+                expiry_type CHAR(4),
+                expiry_date 
+                )'''
+USERS_TABLE = '''CREATE TABLE IF NOT EXISTS users( 
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name VARCHAR(50) NOT NULL UNIQUE
+                )'''
+
+# 商品テーブルのスキーマ変更（名前, SQL）。追加のみ行い、既存の要素は変更しない
+PRODUCT_MIGRATIONS = [
+    ("product_user_expiry_index",
+     "CREATE INDEX IF NOT EXISTS idx_product_user_expiry ON product(user_name, expiry_date)"),
+    ("image_tombstones",
+     "CREATE TABLE IF NOT EXISTS image_tombstones(product_id INTEGER PRIMARY KEY)"),
+    ("product_expiry_index",
+     "CREATE INDEX IF NOT EXISTS idx_product_expiry ON product(expiry_date)"),
+    #シャードのDBにはusersテーブルがないため、外部キーの制約は有効にしない
+    ("product_user_id",
+     "ALTER TABLE product ADD COLUMN user_id INTEGER REFERENCES users(id)"),
+    ("product_user_id_index",
+     "CREATE INDEX IF NOT EXISTS idx_product_user_id_expiry ON product(user_id, expiry_date, id)"),
+    #商品の読み込みはuser_idで絞り込むため、ユーザ名のインデックスは使われない
+    ("drop_product_user_expiry_index",
+     "DROP INDEX IF EXISTS idx_product_user_expiry"),
+]
+
+
+def add_user_ids(conn):
+    """IDのない旧形式のユーザテーブルを、IDを主キーに持つ形式に移行する関数
+
+    同じ名前のユーザが複数ある場合は、最初に登録されたものだけを残す
+
+    Args:
+        conn (sqlite3.Connection): データベース接続オブジェクト
+    """
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(users)")}
+    if "id" in columns:
+        return
+    conn.execute("ALTER TABLE users RENAME TO users_legacy")
+    conn.execute(USERS_TABLE)
+    conn.execute("INSERT INTO users (name) SELECT name FROM users_legacy GROUP BY name ORDER BY MIN(rowid)")
+    conn.execute("DROP TABLE users_legacy")
+
+
+# ユーザテーブルのスキーマ変更（名前, SQLまたは接続を受け取る関数）
+USER_MIGRATIONS = [
+    ("users_id_primary_key", add_user_ids),
+    #通知を送信した最後の日付（再起動時に同じ日の通知を送り直さないため）
+    ("notify_state",
+     "CREATE TABLE IF NOT EXISTS notify_state(name TEXT PRIMARY KEY, last_date TEXT NOT NULL)"),
+]
+
+# 商品の追加時にDBのパスを渡して呼び出す関数（期限通知の再スケジュールなど）
+_insert_listeners = []
+
+
+def add_insert_listener(listener):
+    """商品の追加時に呼び出す関数を登録する関数
+
+    Args:
+        listener (callable): DBのパスを引数に取る関数
+    """
+    _insert_listeners.append(listener)
+
+
+def notify_insert(db_path):
+    """登録された関数に商品の追加を知らせる関数
+
+    Args:
+        db_path (str): 商品を追加したDBのパス
+    """
+    for listener in list(_insert_listeners):
+        listener(db_path)
+
+
+def migrate(conn, migrations):
+    """未適用のスキーマ変更を順番に適用する関数
+
+    適用済みの変更はschema_migrationsテーブルに記録する
+
+    Args:
+        conn (sqlite3.Connection): データベース接続オブジェクト
+        migrations (list): (名前, SQLまたは接続を受け取る関数)のタプルのリスト
+    """
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_migrations(name TEXT PRIMARY KEY)")
+        applied = {r["name"] for r in conn.execute("SELECT name FROM schema_migrations")}
+        for name, sql in migrations:
+            if name in applied:
+                continue
+            if callable(sql):
+                sql(conn)
+            else:
+                conn.execute(sql)
+            conn.execute("INSERT INTO schema_migrations (name) VALUES (?)", (name,))
+
+
+class ProductCache:
+    """ユーザごとの商品一覧をキャッシュするクラス
+
+    同じDBを使うすべてのセッションで共有し、商品の追加・削除時に無効化する。
+    キーごとに無効化の回数（世代）を数え、読み込み中に無効化された古い一覧は保存しない。
+    """
+    def __init__(self):
+        """初期化メソッド"""
+        self._tables = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """キャッシュされた商品一覧を取得するメソッド
+
+        Args:
+            key (tuple): (DBのパス, ユーザ名)
+
+        Returns:
+            list: 商品データのリスト。キャッシュがない場合はNone
+        """
+        with self._lock:
+            return self._tables.get(key)
+
+    def generation(self, key):
+        """キーの現在の世代を取得するメソッド
+
+        DBから読み込む前に取得し、setに渡す
+
+        Args:
+            key (tuple): (DBのパス, ユーザ名)
+
+        Returns:
+            int: 世代
+        """
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def set(self, key, table, generation):
+        """商品一覧をキャッシュするメソッド
+
+        読み込み開始後に無効化されていた場合は保存しない
+
+        Args:
+            key (tuple): (DBのパス, ユーザ名)
+            table (list): 商品データのリスト
+            generation (int): 読み込み前に取得した世代
+
+        Returns:
+            bool: 保存した場合はTrue
+        """
+        with self._lock:
+            if self._generations.get(key, 0) != generation:
+                return False
+            self._tables[key] = table
+            return True
+
+    def invalidate(self, key):
+        """指定したユーザのキャッシュを破棄するメソッド
+
+        Args:
+            key (tuple): (DBのパス, ユーザ名)
+        """
+        with self._lock:
+            self._tables.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+
+_product_cache = ProductCache()
+# (DBのパス, ユーザ名)ごとのユーザID
+_user_ids = {}
+
+
+class _Lease:
+    """スレッドが借りている接続を保持するオブジェクト
+
+    スレッドローカルにだけ保持するため、スレッドが終了するとこのオブジェクトが破棄され、
+    weakref.finalizeで登録した処理で接続がプールへ返される
+
+    Attributes:
+        conn (sqlite3.Connection): 借りている接続
+    """
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        """初期化メソッド
+
+        Args:
+            conn (sqlite3.Connection): 借りている接続
+        """
+        self.conn = conn
+
+
+class ConnectionPool:
+    """SQLite接続をスレッドに貸し出すコネクションプール
+
+    Streamlitは再実行のたびに新しいスレッドでスクリプトを実行するため、
+    接続はスレッドの終了時にプールへ返し、次のスレッドで使い回す。
+    同じスレッド内では同じ接続を使い、返された接続はmax_idle個まで保持して残りは閉じる。
+
+    Attributes:
+        db_path (str): データベースのパス
+        max_idle (int): 使われていない接続を保持する最大数
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_path, max_idle=MAX_IDLE_CONNECTIONS):
+        """初期化メソッド
+
+        Args:
+            db_path (str): データベースのパス
+            max_idle (int): 使われていない接続を保持する最大数
+        """
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._idle = []
+        self._leases = weakref.WeakSet()
+        self._lock = threading.Lock()
+        #DBを配置するフォルダを作成（プール作成時に一回だけ）
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    @classmethod
+    def get(cls, db_path):
+        """DBのパスごとに共有されるプールを取得するメソッド
+
+        Args:
+            db_path (str): データベースのパス
+
+        Returns:
+            ConnectionPool: コネクションプール
+        """
+        with cls._pools_lock:
+            pool = cls._pools.get(db_path)
+            if pool is None:
+                pool = cls(db_path)
+                cls._pools[db_path] = pool
+            return pool
+
+    def connection(self):
+        """現在のスレッドの接続を取得するメソッド
+
+        スレッドが接続を借りていない場合は、プールの接続か新しい接続を貸し出す
+
+        Returns:
+            sqlite3.Connection: データベース接続オブジェクト
+        """
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            lease = _Lease(self._checkout())
+            weakref.finalize(lease, self._checkin, lease.conn)
+            self._local.lease = lease
+            with self._lock:
+                self._leases.add(lease)
+        return lease.conn
+
+    def _checkout(self):
+        """プールから接続を取り出すメソッド
+
+        Returns:
+            sqlite3.Connection: 使われていない接続。ない場合は新しく作成した接続
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        #スレッドの終了後に別のスレッドで使い回すため、作成したスレッド以外からの利用を許可する
+        conn = sqlite3.connect(self.db_path, cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _checkin(self, conn):
+        """スレッドの終了時に接続をプールへ返すメソッド
+
+        Args:
+            conn (sqlite3.Connection): 返す接続
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            #close_allで閉じられた接続
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        """プールが保持する接続と貸し出し中の接続をすべて閉じるメソッド"""
+        with self._lock:
+            connections = self._idle + [lease.conn for lease in self._leases]
+            self._idle = []
+            self._leases = weakref.WeakSet()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+def default_db_dir():
+    """DBを配置するフォルダのパスを取得する関数
+
+    Returns:
+        str: このファイルと同じ場所のDBフォルダのパス
+    """
+    file_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(file_dir, "DB")
+
+
+def make_image_store(image_dir, image_db_path):
+    """設定に応じた商品画像のストアを作成する関数
+
+    Args:
+        image_dir (str): 画像をファイルで保存するディレクトリのパス
+        image_db_path (str): 画像をSQLiteに保存する場合のDBのパス
+
+    Returns:
+        DirectoryImageStore | SQLiteImageStore: 商品画像のストア
+    """
+    if config.image_store == "directory":
+        return DirectoryImageStore(image_dir)
+    return SQLiteImageStore(ConnectionPool.get(image_db_path),
+                            format=config.image_store_format, quality=config.image_store_quality)
+
 
 # データベース接続とテーブル作成
 class DatabaseManager:
     """商品データのデータベースを管理するクラス
 
+    商品データは設定に応じてユーザごとのシャード（DBファイル）に振り分けて保存する。
+    商品IDの上位ビットにシャード番号を持たせ、IDだけで保存先のシャードを決められるようにする。
+
     Attributes:
-        image_dir (str): 画像を保存するディレクトリのパス
-        db_path (str): データベースのパス
+        db_dir (str): DBを配置するフォルダ
+        image_dir (str): 画像をファイルで保存するディレクトリのパス
+        db_path (str): ユーザテーブルのあるデータベースのパス
+        image_store: 商品画像のストア
+        user_db (UserManager): ユーザIDの取得に使うユーザマネージャ
+        shards (int): シャードの数（1: db_pathのみ、0: ユーザごとに一つ）
     """
-        
-    def __init__(self):
+
+    def __init__(self, db_dir=None):
         """初期化メソッド
-        
+
         画像ディレクトリとデータベースのパスを設定する
+
+        Args:
+            db_dir (str): DBを配置するフォルダ。Noneの場合はこのファイルと同じ場所のDBフォルダ
         """
-        file_dir = os.path.dirname(os.path.abspath(__file__))
-        self.image_dir = os.path.join(file_dir, "DB", "images")
-        self.db_path = os.path.join(file_dir, "DB", "product.db")
+        db_dir = db_dir or default_db_dir()
+        self.db_dir = db_dir
+        self.image_dir = os.path.join(db_dir, "images")
+        self.db_path = os.path.join(db_dir, "product.db")
+        self.pool = ConnectionPool.get(self.db_path)
+        self.image_store = make_image_store(self.image_dir, os.path.join(db_dir, "images.db"))
+        self.user_db = UserManager(db_dir)
+        self.shards = config.db_shards
+        self._ready = set()
+        self._ready_lock = threading.Lock()
 
-    def connect(self):
+    def shard_number(self, user_id):
+        """ユーザの商品データを保存するシャードの番号を取得するメソッド
+
+        Args:
+            user_id (int): ユーザID
+
+        Returns:
+            int: シャード番号（0はユーザテーブルと同じDB）
+        """
+        if self.shards == 1:
+            return 0
+        if self.shards == 0:
+            return user_id
+        return user_id % self.shards + 1
+
+    def shard_path(self, shard):
+        """シャードのDBファイルのパスを取得するメソッド
+
+        Args:
+            shard (int): シャード番号
+
+        Returns:
+            str: DBファイルのパス
+        """
+        if shard == 0:
+            return self.db_path
+        name = f"user_{shard}.db" if self.shards == 0 else f"shard_{shard}.db"
+        return os.path.join(self.db_dir, "shards", name)
+
+    def shard_numbers(self):
+        """作成済みのすべてのシャードの番号を取得するメソッド
+
+        Returns:
+            list: シャード番号のリスト
+        """
+        if self.shards == 1:
+            return [0]
+        shard_dir = os.path.join(self.db_dir, "shards")
+        if not os.path.isdir(shard_dir):
+            return []
+        matches = (SHARD_FILE_PATTERN.fullmatch(name) for name in os.listdir(shard_dir))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def connect(self, shard=0):
         """データベースに接続するメソッド
-        
-        接続がない場合は新しく作成する
+
+        スレッドごとにプールされた接続を返す。シャードには初回の接続時にテーブルを作成する
+
+        Args:
+            shard (int): シャード番号（0はユーザテーブルと同じDB）
 
         Returns:
             sqlite3.Connection: データベース接続オブジェクト
         """
-        #DBを配置するフォルダと画像を保存するフォルダ作成
-        os.makedirs(self.image_dir, exist_ok=True)
-        #DB接続・なければ作成
-        return sqlite3.connect(self.db_path)
+        conn = ConnectionPool.get(self.shard_path(shard)).connection()
+        if shard not in self._ready:
+            with self._ready_lock:
+                if shard not in self._ready:
+                    self.create_shard(conn, shard)
+                    self._ready.add(shard)
+        return conn
+
+    def create_shard(self, conn, shard):
+        """シャードに商品テーブルを作成するメソッド
+
+        商品IDがシャード番号を上位ビットに持つよう、IDの採番の開始位置を設定する
+
+        Args:
+            conn (sqlite3.Connection): シャードへの接続
+            shard (int): シャード番号
+        """
+        with conn:
+            conn.execute(PRODUCT_TABLE)
+        migrate(conn, PRODUCT_MIGRATIONS)
+        if shard:
+            with conn:
+                conn.execute('''INSERT INTO sqlite_sequence (name, seq) SELECT 'product', ?
+                                WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'product')''',
+                             (shard << SHARD_ID_BITS,))
 
     def create(self):
         """商品テーブルを作成するメソッド
-        
+
         すでに商品テーブルが存在する場合は何もしない
         """
-        sql = '''CREATE TABLE IF NOT EXISTS product( 
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_name VARCHAR(50),
-                item_name VARCHAR(50),
-                expiry_type CHAR(4),
-                expiry_date 
-                )'''
+        self.user_db.create(make_init_user=False)
         conn = self.connect()
-        cursor =  conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
-        conn.close()
+        if self.shards == 1:
+            #ユーザIDのない商品データにユーザ名からIDを設定
+            with conn:
+                conn.execute('''UPDATE product SET user_id = (SELECT id FROM users WHERE users.name = product.user_name)
+                                WHERE user_id IS NULL''')
+        #ファイルで保存されていた画像をストアに移行
+        if isinstance(self.image_store, SQLiteImageStore):
+            self.image_store.import_directory(self.image_dir)
+        if self.shards != 1:
+            self.import_unsharded()
+        #前回削除しきれなかった画像を削除
+        self.schedule_cleanup()
+
+    def import_unsharded(self):
+        """ユーザテーブルと同じDBに保存されていた商品データをシャードへ移すメソッド
+
+        商品IDが変わるため、画像も新しいIDで保存し直す。登録されていないユーザの商品データは移さない
+        """
+        conn = self.connect()
+        names = [row["user_name"] for row in conn.execute("SELECT DISTINCT user_name FROM product")]
+        for user_name in names:
+            if self.user_db.get_id(user_name) is None:
+                continue
+            rows = conn.execute('''SELECT id, item_name, expiry_type, expiry_date FROM product
+                                WHERE user_name = ? ORDER BY id''', (user_name,)).fetchall()
+            new_ids = self.insert_many(
+                user_name, [(row["item_name"], row["expiry_type"], row["expiry_date"]) for row in rows])
+            old_ids = [row["id"] for row in rows]
+            for old_id, new_id in zip(old_ids, new_ids):
+                data = self.image_store.load(old_id)
+                if data:
+                    self.image_store.put_bytes(new_id, data)
+            self.image_store.delete(old_ids)
+            with conn:
+                conn.executemany("DELETE FROM product WHERE id = ?", [(id,) for id in old_ids])
 
     def insert(self,user_name, item_name, expiry_type, expiry_date):
         """商品データをデータベースに挿入するメソッド
@@ -61,16 +528,61 @@ class DatabaseManager:
         Returns:
             int: 新しく追加されたデータのID
         """
-        conn = self.connect()
-        cursor = conn.cursor()
-        cursor.execute('''INSERT INTO product (user_name, item_name, expiry_type, expiry_date)
-                        VALUES (?, ?, ?, ?)''', (user_name, item_name, expiry_type, expiry_date))
-        new_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        user_id = self.user_db.get_id(user_name, create=True)
+        with self.connect(self.shard_number(user_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''INSERT INTO product (user_id, user_name, item_name, expiry_type, expiry_date)
+                            VALUES (?, ?, ?, ?, ?)''', (user_id, user_name, item_name, expiry_type, expiry_date))
+            new_id = cursor.lastrowid
+        _product_cache.invalidate((self.db_path, user_name))
+        notify_insert(self.db_path)
 
         return new_id
-    
+
+    def insert_many(self, user_name, rows):
+        """複数の商品データを一つのトランザクションで挿入するメソッド
+
+        Args:
+            user_name (str): ユーザ名
+            rows (list): (商品名, 期限の種類, 期限の日付)のタプルのリスト
+
+        Returns:
+            list: 新しく追加されたデータのID（rowsと同じ順番）
+        """
+        if not rows:
+            return []
+        user_id = self.user_db.get_id(user_name, create=True)
+        rows = [(user_id, user_name, item_name, expiry_type, expiry_date)
+                for item_name, expiry_type, expiry_date in rows]
+
+        with self.connect(self.shard_number(user_id)) as conn:
+            #書き込みロックを先に取得し、採番されるIDを連番にする
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany('''INSERT INTO product (user_id, user_name, item_name, expiry_type, expiry_date)
+                            VALUES (?, ?, ?, ?, ?)''', rows)
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        _product_cache.invalidate((self.db_path, user_name))
+        notify_insert(self.db_path)
+
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def save_images(self, ids, images):
+        """切り出し画像をバックグラウンドで画像ストアへ保存するメソッド
+
+        Args:
+            ids (list): 商品データのID
+            images (list): 保存するエンコード済みの画像（Noneの場合は保存しない）
+
+        Returns:
+            list: 保存処理のFutureのリスト
+        """
+        futures = []
+        for id, image in zip(ids, images):
+            if image:
+                futures.append(_image_writer.submit(self.image_store.put_bytes, id, image))
+        return futures
+
+    @timed("fetch_all_products")
     def fetch_all_products(self, user_name):
         """すべての商品データを期限の昇順で取得するメソッド
 
@@ -80,68 +592,171 @@ class DatabaseManager:
         Returns:
             list: 商品データのリスト
         """
-        conn = self.connect()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM product WHERE user_name = ? ORDER BY expiry_date", (user_name,))
-        table = cursor.fetchall()
-        conn.close()
-            
-        return table
-    
+        key = (self.db_path, user_name)
+        table = _product_cache.get(key)
+        increment("product_cache_miss" if table is None else "product_cache_hit")
+        if table is None:
+            generation = _product_cache.generation(key)
+            user_id = self.user_db.get_id(user_name)
+            if user_id is None:
+                return []
+            cursor = self.connect(self.shard_number(user_id)).cursor()
+            cursor.execute("SELECT * FROM product WHERE user_id = ? ORDER BY expiry_date, id", (user_id,))
+            table = cursor.fetchall()
+            _product_cache.set(key, table, generation)
+
+        return list(table)
+
+    def fetch_products(self, user_name, limit, after=None):
+        """商品データを期限の昇順でページ単位に取得するメソッド
+
+        Args:
+            user_name (str): ユーザ名
+            limit (int): 取得する最大件数
+            after (tuple): 前ページ最後の(期限の日付, ID)。Noneの場合は先頭から取得
+
+        Returns:
+            list: 商品データのリスト
+        """
+        user_id = self.user_db.get_id(user_name)
+        if user_id is None:
+            return []
+        cursor = self.connect(self.shard_number(user_id)).cursor()
+        if after is None:
+            cursor.execute('''SELECT * FROM product WHERE user_id = ?
+                            ORDER BY expiry_date, id LIMIT ?''', (user_id, limit))
+        else:
+            expiry_date, id = after
+            cursor.execute('''SELECT * FROM product WHERE user_id = ? AND (expiry_date, id) > (?, ?)
+                            ORDER BY expiry_date, id LIMIT ?''', (user_id, expiry_date, id, limit))
+        return cursor.fetchall()
+
     def delete(self, id):
         """指定されたIDの商品データをデータベースから削除するメソッド
 
         Args:
             id (int): 削除する商品データのID
         """
-        conn = self.connect()
-        cursor =  conn.cursor()
-        cursor.execute("DELETE FROM product WHERE id=?", (id,))
-       
-        conn.commit()
-        conn.close()
+        self.delete_many([id])
+
+    def delete_many(self, ids):
+        """指定された複数のIDの商品データをシャードごとに一つのトランザクションで削除するメソッド
+
+        関連する画像は同じトランザクションで削除予定として記録し、
+        コミット後にバックグラウンドで削除する
+
+        Args:
+            ids (list): 削除する商品データのID
+
+        Returns:
+            concurrent.futures.Future: 画像の削除処理のFuture。削除するものがない場合はNone
+        """
+        ids = list(ids)
+        if not ids:
+            return None
+        shards = {}
+        for id in ids:
+            shards.setdefault(id >> SHARD_ID_BITS, []).append(id)
+        users = set()
+        for shard, shard_ids in shards.items():
+            placeholders = ", ".join("?" * len(shard_ids))
+            with self.connect(shard) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT DISTINCT user_name FROM product WHERE id IN ({placeholders})", shard_ids)
+                users.update(row["user_name"] for row in cursor.fetchall())
+                cursor.execute(f"DELETE FROM product WHERE id IN ({placeholders})", shard_ids)
+                cursor.executemany("INSERT OR IGNORE INTO image_tombstones (product_id) VALUES (?)",
+                                   [(id,) for id in shard_ids])
+        for user_name in users:
+            _product_cache.invalidate((self.db_path, user_name))
         # 関連する切り出し画像を削除
-        image_path = os.path.join(self.image_dir, f"{id}.png")
-        if os.path.exists(image_path):
-            os.remove(image_path)
+        return self.schedule_cleanup()
+
+    def delete_user_products(self, user_name):
+        """指定されたユーザのすべての商品データを削除するメソッド
+
+        画像はdelete_manyと同じく削除予定として記録し、ユーザの商品一覧のキャッシュも無効にする
+
+        Args:
+            user_name (str): ユーザ名
+
+        Returns:
+            concurrent.futures.Future: 画像の削除処理のFuture。削除するものがない場合はNone
+        """
+        _product_cache.invalidate((self.db_path, user_name))
+        user_id = self.user_db.get_id(user_name)
+        if user_id is None:
+            return None
+        shard = self.shard_number(user_id)
+        #シャードがまだ作成されていなければ商品はない
+        if shard and not os.path.exists(self.shard_path(shard)):
+            return None
+        rows = self.connect(shard).execute("SELECT id FROM product WHERE user_id = ?", (user_id,)).fetchall()
+        return self.delete_many(row["id"] for row in rows)
+
+    def schedule_cleanup(self):
+        """削除予定の画像の削除をバックグラウンドで行うメソッド
+
+        Returns:
+            concurrent.futures.Future: 削除処理のFuture
+        """
+        return _image_writer.submit(self.cleanup_images)
+
+    def cleanup_images(self):
+        """すべてのシャードで削除予定として記録された画像を削除するメソッド
+
+        画像を削除した後に記録を消すため、途中で停止しても次回の起動時に削除し直す。
+        最後に参照されなくなった画像をストアから削除し、空きが多ければファイルを縮小する
+
+        Returns:
+            int: 削除した画像の数
+        """
+        count = 0
+        for shard in self.shard_numbers():
+            conn = self.connect(shard)
+            ids = [row["product_id"] for row in conn.execute("SELECT product_id FROM image_tombstones")]
+            if not ids:
+                continue
+            self.image_store.delete(ids)
+            with conn:
+                conn.executemany("DELETE FROM image_tombstones WHERE product_id = ?", [(id,) for id in ids])
+            count += len(ids)
+        self.image_store.compact(config.image_store_vacuum_ratio)
+        return count
 
 class UserManager():
-    def __init__(self):
+    def __init__(self, db_dir=None):
         """初期化メソッド
-        
+
         データベースのパスを設定する
+
+        Args:
+            db_dir (str): DBを配置するフォルダ。Noneの場合はこのファイルと同じ場所のDBフォルダ
         """
-        file_dir = os.path.dirname(os.path.abspath(__file__))
-        self.image_dir = os.path.join(file_dir, "DB")
-        self.db_path = os.path.join(file_dir, "DB", "product.db")
+        db_dir = db_dir or default_db_dir()
+        self.image_dir = db_dir
+        self.db_path = os.path.join(db_dir, "product.db")
+        self.pool = ConnectionPool.get(self.db_path)
 
     def connect(self):
         """データベースに接続するメソッド
-        
-        接続がない場合は新しく作成する
+
+        スレッドごとにプールされた接続を返す
 
         Returns:
             sqlite3.Connection: データベース接続オブジェクト
         """
-        #DBを配置するフォルダと画像を保存するフォルダ作成
-        os.makedirs(self.image_dir, exist_ok=True)
-        #DB接続・なければ作成
-        return sqlite3.connect(self.db_path)
+        return self.pool.connection()
 
     def create(self, make_init_user = True):
         """ユーザテーブルを作成するメソッド
-        
+
         すでにテーブルが存在する場合は何もしない
         """
-        sql = '''CREATE TABLE IF NOT EXISTS users( 
-                name VARCHAR(50)
-                )'''
-        conn = self.connect()
-        cursor =  conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
-        conn.close()
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(USERS_TABLE)
+        migrate(self.connect(), USER_MIGRATIONS)
 
         #ユーザが登録されていなければguestユーザを作成
         if make_init_user and not len(self.get_users()):
@@ -152,43 +767,61 @@ class UserManager():
         """すべてのユーザ情報を取得するメソッド
 
         Returns:
-            list: ユーザ名のリスト
+            list: ユーザIDとユーザ名のリスト（登録順）
         """
-        conn = self.connect()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM users")
+        cursor = self.connect().cursor()
+        cursor.execute("SELECT id, name FROM users ORDER BY id")
         table = cursor.fetchall()
-        conn.close()
 
         return table
 
+    def get_id(self, name, create=False):
+        """ユーザ名からユーザIDを取得するメソッド
+
+        Args:
+            name (str): ユーザ名
+            create (bool): 登録されていない場合に登録するかどうか
+
+        Returns:
+            int: ユーザID。登録されていない場合はNone
+        """
+        user_id = _user_ids.get((self.db_path, name))
+        if user_id is not None:
+            return user_id
+        row = self.connect().execute("SELECT id FROM users WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return self.register(name) if create else None
+        _user_ids[(self.db_path, name)] = row["id"]
+        return row["id"]
+
     def register(self,name):
         """新規にユーザ情報を追加するメソッド
 
+        すでに同じ名前のユーザがいる場合は追加しない
+
         Args:
             item_name (name): ユーザ名
 
         Returns:
-            int: 新しく追加されたデータのID
+            int: ユーザのID
         """
-        conn = self.connect()
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO users (name) VALUES (?)', (name,))
-        new_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT OR IGNORE INTO users (name) VALUES (?)', (name,))
+            new_id = cursor.execute("SELECT id FROM users WHERE name = ?", (name,)).fetchone()["id"]
+        _user_ids[(self.db_path, name)] = new_id
 
         return new_id
 
     def delete(self, name):
         """指定されたユーザを削除するメソッド
 
+        ユーザの商品データはDatabaseManager.delete_user_productsで先に削除しておく
+
         Args:
-            id (int): 削除する商品データのID
+            name (str): 削除するユーザ名
         """
-        conn = self.connect()
-        cursor =  conn.cursor()
-        cursor.execute("DELETE FROM users WHERE name=?", (name,))
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM users WHERE name=?", (name,))
+        _user_ids.pop((self.db_path, name), None)
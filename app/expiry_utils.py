@@ -0,0 +1,46 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+# 期限が近いとみなす残り日数
+SOON_DAYS = 3
+# 期限の状態ごとの(表示名, 背景色, 文字色)。表示する順番に並べる
+EXPIRY_STATUSES = {
+    "expired": ("期限切れ", "#FF6666", "#000000"),
+    "today": ("今日まで", "#FFA500", "#000000"),
+    "soon": (f"{SOON_DAYS}日以内", "#FFFF66", "#000000"),
+    "ok": ("期限内", "", ""),
+}
+PRODUCT_COLUMNS = ["id", "user_name", "item_name", "expiry_type", "expiry_date"]
+
+
+def products_frame(products):
+    """商品データのリストをDataFrameに変換する関数
+
+    Args:
+        products (list): 商品データ（sqlite3.Row）のリスト
+
+    Returns:
+        pandas.DataFrame: 商品データのDataFrame
+    """
+    return pd.DataFrame([[row[column] for column in PRODUCT_COLUMNS] for row in products], columns=PRODUCT_COLUMNS)
+
+
+def add_expiry_status(df, today=None):
+    """期限までの残り日数と期限の状態の列をまとめて計算する関数
+
+    Args:
+        df (pandas.DataFrame): expiry_date列を持つ商品データ
+        today (datetime.date): 基準日。Noneの場合は今日
+
+    Returns:
+        pandas.DataFrame: remaining列とstatus列を追加したDataFrame
+    """
+    today = pd.Timestamp(today or datetime.date.today())
+    remaining = (pd.to_datetime(df["expiry_date"], format="%Y-%m-%d", errors="coerce") - today).dt.days
+    status = np.select(
+        [remaining < 0, remaining == 0, remaining <= SOON_DAYS],
+        ["expired", "today", "soon"],
+        default="ok",
+    )
+    return df.assign(remaining=remaining.astype("Int64"), status=status)
@@ -0,0 +1,204 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import config
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """サーキットブレーカーが開いている間の呼び出しで送出される例外"""
+
+
+class CircuitBreaker:
+    """連続して失敗したエンドポイントへの呼び出しを一時的に止めるクラス
+
+    failure_threshold回連続で失敗すると開き、reset_timeout秒経過後に
+    一回だけ試行を許可する。試行が成功すれば閉じ、失敗すれば再び開く。
+
+    Attributes:
+        failure_threshold (int): 開くまでの連続失敗回数
+        reset_timeout (float): 開いてから試行を許可するまでの秒数
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """初期化メソッド
+
+        Args:
+            failure_threshold (int): 開くまでの連続失敗回数
+            reset_timeout (float): 開いてから試行を許可するまでの秒数
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """呼び出しを許可するかどうかを判定するメソッド
+
+        Returns:
+            bool: 呼び出してよい場合はTrue
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                #試行を一回だけ許可し、結果が出るまで他の呼び出しは止める
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def is_open(self):
+        """呼び出しを止めている状態かどうかを判定するメソッド
+
+        Returns:
+            bool: 開いている場合はTrue
+        """
+        with self._lock:
+            return self._opened_at is not None
+
+    def record_success(self):
+        """呼び出しの成功を記録するメソッド"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """呼び出しの失敗を記録するメソッド"""
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class HttpClient:
+    """推論サーバーへのリクエストを行う共有HTTPクライアント
+
+    接続はrequests.Sessionでプールし、すべてのセッション・再実行で使い回す。
+    エンドポイントごとにタイムアウト、リトライ、サーキットブレーカーを設定する。
+
+    Attributes:
+        session (requests.Session): プールされたHTTPセッション
+        timeouts (dict): エンドポイント名ごとの(接続, 読み込み)タイムアウト秒数
+    """
+    def __init__(self, timeouts, retries=2, backoff_factor=0.5, pool_maxsize=16,
+                 failure_threshold=5, reset_timeout=30.0):
+        """初期化メソッド
+
+        Args:
+            timeouts (dict): エンドポイント名ごとの(接続, 読み込み)タイムアウト秒数
+            retries (int): 接続失敗・502/503応答時の最大リトライ回数
+            backoff_factor (float): リトライ間隔の指数バックオフの係数
+            pool_maxsize (int): ホストごとに保持する接続数
+            failure_threshold (int): サーキットブレーカーが開くまでの連続失敗回数
+            reset_timeout (float): サーキットブレーカーが開いてから試行を許可するまでの秒数
+        """
+        self.timeouts = timeouts
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.session = requests.Session()
+        #読み込みタイムアウトと504は再送しない（サーバー側で推論が続いている可能性があり、二重に実行させないため）
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            #Falseにすると再送せずにReadTimeoutErrorをそのまま送出し、requests.Timeoutとして扱える
+            read=False,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._breakers = {name: self._new_breaker() for name in timeouts}
+
+    def post(self, endpoint, url, **kwargs):
+        """POSTリクエストを送信するメソッド
+
+        Args:
+            endpoint (str): エンドポイント名（タイムアウトとサーキットブレーカーの選択に使う）
+            url (str): 送信先のURL
+            **kwargs: requests.Session.postに渡す引数
+
+        Returns:
+            requests.Response: サーバーからの応答
+
+        Raises:
+            CircuitOpenError: エンドポイントへの呼び出しが停止されている場合
+            requests.RequestException: 通信に失敗した場合、またはエラー応答の場合
+        """
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers.setdefault(endpoint, self._new_breaker())
+        if not breaker.allow():
+            raise CircuitOpenError(f"{endpoint} は一時的に利用できません")
+
+        kwargs.setdefault("timeout", self.timeouts.get(endpoint))
+        try:
+            response = self.session.post(url, **kwargs)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            #4xxはサーバーが応答しているため、失敗として数えない
+            if is_unavailable(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        return response
+
+    def _new_breaker(self):
+        """エンドポイント用のサーキットブレーカーを作成するメソッド
+
+        Returns:
+            CircuitBreaker: サーキットブレーカー
+        """
+        return CircuitBreaker(self.failure_threshold, self.reset_timeout)
+
+    def available(self, endpoint):
+        """エンドポイントへの呼び出しが止められていないかを判定するメソッド
+
+        Args:
+            endpoint (str): エンドポイント名
+
+        Returns:
+            bool: サーキットブレーカーが閉じている場合はTrue
+        """
+        breaker = self._breakers.get(endpoint)
+        return breaker is None or not breaker.is_open()
+
+
+def is_unavailable(error):
+    """例外がサーバーに接続できないことによるものかを判定する関数
+
+    接続の失敗、タイムアウト、5xx応答、サーキットブレーカーによる停止が該当する
+
+    Args:
+        error (Exception): 送出された例外
+
+    Returns:
+        bool: サーバーに接続できないことによる例外の場合はTrue
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code >= 500
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """プロセスで共有するHTTPクライアントを取得するメソッド
+
+    Returns:
+        HttpClient: HTTPクライアント
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(config.http_timeouts, retries=config.http_retries)
+        return _client
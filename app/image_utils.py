@@ -1,7 +1,64 @@
 
-import requests
 import config
-from PIL import Image
+import requests
+from http_client import get_client
+from cache_utils import ResultCache, content_hash, cache_db_path
+from metrics_utils import timed, increment
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+# EXIFの向き情報のタグと、縦横が入れ替わる向きの値
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+UPLOAD_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# 画像の内容のハッシュ値をキーとした検出結果のキャッシュ（全セッションで共有）
+detection_cache = ResultCache(
+    "detection_cache",
+    max_entries=config.detection_cache_size,
+    ttl=config.detection_cache_ttl,
+    db_path=cache_db_path() if config.detection_cache_persist else None,
+    stale_ttl=config.degraded_cache_ttl,
+)
+
+
+def oriented_size(img):
+    """EXIFの向きを適用した後の画像サイズを取得する関数
+
+    Args:
+        img (PIL.Image): 画像
+
+    Returns:
+        tuple: (幅, 高さ)
+    """
+    width, height = img.size
+    if img.getexif().get(EXIF_ORIENTATION, 1) in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+def data_uri(data):
+    """エンコードされた画像をdata URIに変換する関数
+
+    Args:
+        data (bytes): エンコードされた画像（PNG, JPEG, WebP）
+
+    Returns:
+        str: data URI
+    """
+    if data.startswith(b"\x89PNG"):
+        mime_type = "image/png"
+    elif data.startswith(b"\xff\xd8"):
+        mime_type = "image/jpeg"
+    elif data[8:12] == b"WEBP":
+        mime_type = "image/webp"
+    else:
+        mime_type = "application/octet-stream"
+    return f"data:{mime_type};base64," + base64.b64encode(data).decode("ascii")
 
 class ImageUploader():
     """画像を指定されたサーバーにアップロードするクラス
@@ -9,6 +66,7 @@ class ImageUploader():
     Attributes:
         server_url (str): アップロード先のサーバーのURL
         image (obj): アップロードする画像オブジェクト
+        scale (tuple): 送信した画像の元画像に対する(横, 縦)の縮小率
     """
     def __init__(self, image):
         """初期化メソッド
@@ -18,6 +76,7 @@ class ImageUploader():
         """
         self.server_url = "http://" + config.server_ip + "/food-expiration/"
         self.image = image
+        self.scale = (1.0, 1.0)
 
     def get_content_type(self):
         """ファイル拡張子に基づいてMIMEタイプを取得するメソッド
@@ -32,17 +91,137 @@ class ImageUploader():
         else:
             return "application/octet-stream"
         
+    @timed("image_upload")
     def upload(self):
         """画像をAPIにアップロードし、データを取得するメソッド
 
         Returns:
             dict: サーバーからの応答データ。エラーが発生した場合はNone
         """
-        mime_type = self.get_content_type()
-        files = {"file": (self.image.name, self.image.getvalue(), mime_type)}
+        #同じ画像の検出結果があればサーバーに送信しない
+        key = self.cache_key()
+        response_data = detection_cache.get(key)
+        increment("detection_cache_miss" if response_data is None else "detection_cache_hit")
+        if response_data is not None:
+            return response_data
+
+        files = {"file": self.preprocess()}
 
-        response = requests.post(self.server_url, files=files)
-        response_data = response.json()
+        try:
+            response = get_client().post("food-expiration", self.server_url, files=files)
+        except requests.RequestException as e:
+            #サーバーに接続できない場合は期限切れの検出結果を返す
+            return detection_cache.fallback(key, e)
+        response_data = self.restore_coordinates(response.json())
+        if isinstance(response_data, dict) and "data" in response_data:
+            detection_cache.set(key, response_data)
+        return response_data
+
+    @classmethod
+    def upload_many(cls, images):
+        """複数の画像を一回のリクエストでアップロードし、画像ごとのデータを取得するメソッド
+
+        config.detection_batch_pathのエンドポイントに"files"として送信し、
+        応答の"results"に画像と同じ順番で各画像の応答データが入っていることを想定する。
+        キャッシュ済みの画像は送信しない。
+
+        Args:
+            images (list): アップロードする画像オブジェクトのリスト
+
+        Returns:
+            list: 画像ごとのサーバーからの応答データ（imagesと同じ順番）
+        """
+        uploaders = [cls(image) for image in images]
+        keys = [uploader.cache_key() for uploader in uploaders]
+        results = [detection_cache.get(key) for key in keys]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        server_url = "http://" + config.server_ip + config.detection_batch_path
+        files = [("files", uploaders[i].preprocess()) for i in pending]
+        try:
+            response = get_client().post("food-expiration", server_url, files=files)
+        except requests.RequestException as e:
+            for i in pending:
+                results[i] = detection_cache.fallback(keys[i], e)
+            return results
+        for i, response_data in zip(pending, response.json()["results"]):
+            response_data = uploaders[i].restore_coordinates(response_data)
+            if isinstance(response_data, dict) and "data" in response_data:
+                detection_cache.set(keys[i], response_data)
+            results[i] = response_data
+        return results
+
+    def cache_key(self):
+        """検出結果のキャッシュのキーを作成するメソッド
+
+        画像の内容と送信前の縮小・再エンコードの設定から作成する
+
+        Returns:
+            str: キャッシュのキー
+        """
+        settings = f"{config.upload_max_edge}:{config.upload_format}:{config.upload_quality}"
+        return content_hash(self.image.getvalue(), settings)
+
+    def preprocess(self):
+        """送信前に画像の向きを補正し、縮小・再エンコードするメソッド
+
+        長辺がconfig.upload_max_edge以下で向きの補正も不要な場合は元のまま送信する。
+        切り出しは向きを補正した画像に対して行うため、縮小しない設定（0）でも向きは補正する
+
+        Returns:
+            tuple: (ファイル名, 画像のバイト列, MIMEタイプ)
+        """
+        data = self.image.getvalue()
+        max_edge = config.upload_max_edge
+
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = oriented_size(img)
+            ratio = min(max_edge / max(width, height), 1.0) if max_edge else 1.0
+            orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+            if ratio == 1.0 and orientation == 1:
+                self.scale = (1.0, 1.0)
+                return self.image.name, data, self.get_content_type()
+
+            new_size = (max(int(width * ratio), 1), max(int(height * ratio), 1))
+            #JPEGはデコード時に縮小する（向きを補正する前の縦横で指定）
+            if img.format == "JPEG":
+                draft_size = new_size if orientation not in TRANSPOSED_ORIENTATIONS else new_size[::-1]
+                img.draft("RGB", draft_size)
+            resized = ImageOps.exif_transpose(img)
+            if resized.size != new_size:
+                resized = resized.resize(new_size, Image.LANCZOS)
+            if resized.mode not in ("RGB", "L"):
+                resized = resized.convert("RGB")
+
+            buf = io.BytesIO()
+            resized.save(buf, config.upload_format, quality=config.upload_quality)
+
+        self.scale = (new_size[0] / width, new_size[1] / height)
+        name = os.path.splitext(self.image.name)[0] + "." + config.upload_format.lower()
+        mime_type = UPLOAD_MIME_TYPES.get(config.upload_format, "application/octet-stream")
+        return name, buf.getvalue(), mime_type
+
+    def restore_coordinates(self, response_data):
+        """サーバーが返した座標を元画像の座標に戻すメソッド
+
+        Args:
+            response_data (dict): サーバーからの応答データ
+
+        Returns:
+            dict: 座標を元画像の座標に変換した応答データ
+        """
+        scale_x, scale_y = self.scale
+        if (scale_x, scale_y) == (1.0, 1.0) or not isinstance(response_data, dict):
+            return response_data
+
+        for row in response_data.get("data", []):
+            #座標は(xmin, ymin, xmax, ymax)の順
+            keys = list(row["coordinate"].keys())
+            values = list(row["coordinate"].values())
+            scales = (scale_x, scale_y, scale_x, scale_y)
+            row["coordinate"] = {k: v / s for k, v, s in zip(keys, values, scales)}
         return response_data
 
 # 画像処理サーバへのリクエスト
@@ -62,6 +241,69 @@ class ImageProcessor:
         self.length = 150
         self.image = image
 
+    @classmethod
+    @timed("crop_squares")
+    def crop_squares(cls, image, boxes, length=150, max_workers=4):
+        """画像を一度だけデコードし、すべての座標を正方形に切り出すメソッド
+
+        切り出し後の画像に必要な解像度まで縮小してからデコードし、
+        各座標の切り出しとリサイズはスレッドプールで並列に行う
+
+        Args:
+            image (obj): 処理する画像ファイル
+            boxes (list): (xmin, ymin, xmax, ymax)のタプルのリスト（元画像の座標）
+            length (int): 切り出し後の画像のサイズ
+            max_workers (int): 並列に処理するスレッド数
+
+        Returns:
+            list: 正方形に切り出した画像のリスト（boxesと同じ順番）
+        """
+        if not boxes:
+            return []
+
+        with Image.open(image) as src:
+            width, height = src.size
+            #座標はEXIFの向きを適用した元画像に対するもの（draftで縮小する前のサイズを使う）
+            oriented_width, oriented_height = oriented_size(src)
+            factor = cls.reduce_factor(boxes, length)
+            #JPEGはデコード時に縮小する
+            if factor > 1 and src.format == "JPEG":
+                src.draft("RGB", (width // factor, height // factor))
+            src.load()
+            #JPEG以外（またはdraftで縮小しきれなかった分）はデコード後に縮小する
+            #draftは端数を切り上げたサイズになるため、実際の縮小率は小数で求める
+            remaining = max(int(factor / (width / src.width)), 1)
+            img = ImageOps.exif_transpose(src)
+            if remaining > 1:
+                img = img.reduce(remaining)
+
+            ratio_x = img.width / oriented_width
+            ratio_y = img.height / oriented_height
+            scaled = [(xmin * ratio_x, ymin * ratio_y, xmax * ratio_x, ymax * ratio_y)
+                      for xmin, ymin, xmax, ymax in boxes]
+
+            def crop_square(box):
+                processor = cls(img.crop(box))
+                processor.length = length
+                return processor.square().image
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(crop_square, scaled))
+
+    @staticmethod
+    def reduce_factor(boxes, length):
+        """切り出し後の画質を保ったまま元画像を縮小できる倍率を求めるメソッド
+
+        Args:
+            boxes (list): (xmin, ymin, xmax, ymax)のタプルのリスト
+            length (int): 切り出し後の画像のサイズ
+
+        Returns:
+            int: 縮小倍率（1の場合は縮小しない）
+        """
+        longest = min(max(xmax - xmin, ymax - ymin) for xmin, ymin, xmax, ymax in boxes)
+        return max(int(longest // length), 1)
+
     def crop(self, xmin, ymin, xmax, ymax):
         """指定された座標とサイズに基づいて画像をクロッピングするメソッド
 
@@ -95,7 +337,7 @@ class ImageProcessor:
         # アスペクト比を保持しながら画像をリサイズ
         new_width = int(width * ratio)
         new_height = int(height * ratio)
-        self.image = self.image.resize((new_width, new_height), Image.ANTIALIAS)
+        self.image = self.image.resize((new_width, new_height), Image.LANCZOS)
 
         # 正方形の背景を作成
         background = Image.new('RGB', (self.length, self.length), (255, 255, 255))
@@ -107,4 +349,86 @@ class ImageProcessor:
         background.paste(self.image, offset)
             
         self.image = background
-        return self
\ No newline at end of file
+        return self
+
+
+class ThumbnailCache:
+    """登録済み画像のサムネイルをエンコード済みのバイト列で保持するLRUキャッシュ
+
+    キーは(ID, 画像の版)とし、画像が書き換えられた場合は別のキーになる。
+    保持するバイト数の合計がmax_bytesを超えた場合は古いものから破棄する。
+
+    Attributes:
+        max_bytes (int): キャッシュに保持する最大バイト数
+        length (int): サムネイルの最大の辺の長さ
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, length=150):
+        """初期化メソッド
+
+        Args:
+            max_bytes (int): キャッシュに保持する最大バイト数
+            length (int): サムネイルの最大の辺の長さ
+        """
+        self.max_bytes = max_bytes
+        self.length = length
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, id, version, load):
+        """サムネイルを取得するメソッド
+
+        キャッシュにない場合はloadで画像を読み込んでキャッシュする
+
+        Args:
+            id (int): 商品データのID
+            version: 画像の版（更新時刻やハッシュ値）
+            load (callable): エンコードされた画像を返す関数（画像がない場合はNone）
+
+        Returns:
+            bytes: エンコード済みのサムネイル。画像がない場合はNone
+        """
+        key = (id, version)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        data = load()
+        if data is None:
+            return None
+        data = self.shrink(data)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self._size += len(data)
+            self._evict()
+        return data
+
+    def shrink(self, data):
+        """エンコードされた画像からサムネイルのバイト列を作成するメソッド
+
+        Args:
+            data (bytes): エンコードされた画像
+
+        Returns:
+            bytes: エンコード済みのサムネイル
+        """
+        with Image.open(io.BytesIO(data)) as img:
+            #登録時に縮小済みの画像はデコードせずそのまま使う
+            if max(img.size) <= self.length:
+                return data
+            img.thumbnail((self.length, self.length))
+            buf = io.BytesIO()
+            img.save(buf, "PNG")
+        return buf.getvalue()
+
+    def _evict(self):
+        """最大バイト数を超えた分を古いものから破棄するメソッド"""
+        while self._size > self.max_bytes and self._entries:
+            _, data = self._entries.popitem(last=False)
+            self._size -= len(data)
+
+
+thumbnail_cache = ThumbnailCache()
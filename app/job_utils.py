@@ -0,0 +1,122 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import config
+from metrics_utils import increment
+
+
+class JobQueue:
+    """時間のかかる処理をスクリプトの実行スレッド外で行うジョブキュー
+
+    ジョブはIDで管理し、完了したジョブの結果はpopで一度だけ取り出す。
+    完了したジョブのうち、doneでの確認（または完了）からresult_ttl秒が経過したものは、
+    セッションが閉じられて取り出されないジョブとみなして破棄する
+
+    Attributes:
+        max_workers (int): 同時に実行するジョブの数
+        result_ttl (float): 確認されなくなった完了済みのジョブを保持する秒数
+    """
+    def __init__(self, max_workers=4, result_ttl=600.0):
+        """初期化メソッド
+
+        Args:
+            max_workers (int): 同時に実行するジョブの数
+            result_ttl (float): 確認されなくなった完了済みのジョブを保持する秒数
+        """
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        #ジョブのIDと最後に確認・完了した時刻（古い順）
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """ジョブを追加するメソッド
+
+        Args:
+            fn (callable): 実行する処理
+            *args: fnに渡す引数
+            **kwargs: fnに渡すキーワード引数
+
+        Returns:
+            str: ジョブのID
+        """
+        job_id = str(uuid.uuid4())
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._evict_expired()
+            self._jobs[job_id] = future
+            self._touch(job_id)
+        future.add_done_callback(lambda _: self._mark_finished(job_id))
+        return job_id
+
+    def done(self, job_id):
+        """ジョブが完了したかどうかを判定するメソッド
+
+        確認されたジョブは、取り出されるまで破棄されないように保持期間を延長する
+
+        Args:
+            job_id (str): ジョブのID
+
+        Returns:
+            bool: 完了している（または存在しない）場合はTrue
+        """
+        with self._lock:
+            future = self._jobs.get(job_id)
+            if future is not None:
+                self._touch(job_id)
+        return future is None or future.done()
+
+    def pop(self, job_id):
+        """完了したジョブを取り出すメソッド
+
+        Args:
+            job_id (str): ジョブのID
+
+        Returns:
+            concurrent.futures.Future: ジョブのFuture。存在しない（破棄された）場合はNone
+        """
+        with self._lock:
+            self._seen.pop(job_id, None)
+            return self._jobs.pop(job_id, None)
+
+    def _touch(self, job_id):
+        """ジョブを最後に確認した時刻を更新するメソッド（ロックを取得した状態で呼び出す）
+
+        Args:
+            job_id (str): ジョブのID
+        """
+        self._seen[job_id] = time.monotonic()
+        self._seen.move_to_end(job_id)
+
+    def _mark_finished(self, job_id):
+        """ジョブが完了した時刻を記録するメソッド
+
+        Args:
+            job_id (str): ジョブのID
+        """
+        with self._lock:
+            if job_id in self._jobs:
+                self._touch(job_id)
+
+    def _evict_expired(self):
+        """確認されないまま保持期間を過ぎた完了済みのジョブを破棄するメソッド（ロックを取得した状態で呼び出す）"""
+        deadline = time.monotonic() - self.result_ttl
+        expired = []
+        for job_id, seen_at in self._seen.items():
+            if seen_at > deadline:
+                break
+            expired.append(job_id)
+        for job_id in expired:
+            #実行中のジョブは完了時に時刻が更新されるため残す
+            if self._jobs[job_id].done():
+                del self._seen[job_id]
+                del self._jobs[job_id]
+                increment("job_expired")
+
+
+# 全セッションで共有するジョブキュー
+job_queue = JobQueue(max_workers=config.job_workers, result_ttl=config.job_result_ttl)
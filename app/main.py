@@ -3,7 +3,6 @@ import streamlit as st
 import pandas as pd
 
 import enum
-from dataclasses import dataclass,field
 import os
 from PIL import Image
 import PIL
@@ -11,32 +10,82 @@ import datetime
 import copy
 import json
 import uuid
-from image_utils import ImageProcessor, ImageUploader
+import io
+import concurrent.futures
+from image_utils import ImageProcessor, ImageUploader, thumbnail_cache, data_uri
 from db_utils import DatabaseManager,UserManager
+from store_utils import encode_image
 from chat_utils import Ingredient, Ingredients, DishProposer
+from job_utils import job_queue
+from expiry_utils import EXPIRY_STATUSES, products_frame, add_expiry_status
+from metrics_utils import metrics, timer, timed, start_server
+from notify_utils import ExpiryScheduler, make_sink
+from http_client import get_client
+import standin_server
+import config
 
 AVAILABLE_IMAGE_TYPE = ["jpg", "png", "jpeg"]
+DISPLAY_PAGE_SIZE = 20
+DISPLAY_MODES = ["一覧", "表", "期限ごと"]
 EXPIRY_TYPE_DICT = {"消費期限" : 0, "賞味期限" : 1}
 
 
-@dataclass
 class InputData:
-    """入力データを表すデータクラス
+    """入力データを表すクラス
+
+    セッションごとに保持されるため、切り出し画像はエンコード済みのバイト列で持ち、
+    デコードは表示時にブラウザで行う
 
     Attributes:
         id (str): データの一意のID。
-        image (PIL.Image): 画像ファイル。
+        image (bytes): エンコード済みの切り出し画像。
         item_name (str): 商品名。
         expiry_type (str): 期限の種類（例："消費期限"）。
         expiry_date (datetime.date): 期限の日付。
         enable (bool): データが有効かどうかを示すフラグ。
+        image_source (str): 画像の変更に使ったファイルのID。同じファイルを再処理しないために使う。
     """
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
-    image: Image = None #画像ファイル
-    item_name: str = ""
-    expiry_type: str = "消費期限"
-    expiry_date: type(datetime.date) = datetime.date.today()
-    enable: bool = True
+    __slots__ = ("id", "image", "item_name", "expiry_type", "expiry_date", "enable", "image_source")
+
+    def __init__(self, image=None, item_name="", expiry_type="消費期限", expiry_date=None,
+                 enable=True, image_source=None):
+        """初期化メソッド
+
+        Args:
+            image (bytes): エンコード済みの切り出し画像。
+            item_name (str): 商品名。
+            expiry_type (str): 期限の種類。
+            expiry_date (datetime.date): 期限の日付。Noneの場合は今日。
+            enable (bool): データが有効かどうかを示すフラグ。
+            image_source (str): 画像の変更に使ったファイルのID。
+        """
+        self.id = str(uuid.uuid4())
+        self.image = image
+        self.item_name = item_name
+        self.expiry_type = expiry_type
+        self.expiry_date = expiry_date or datetime.date.today()
+        self.enable = enable
+        self.image_source = image_source
+
+    @staticmethod
+    def encode(image):
+        """切り出し画像を画像ストアと同じ形式でエンコードするメソッド
+
+        Args:
+            image (PIL.Image): 切り出し画像
+
+        Returns:
+            bytes: エンコードされた画像
+        """
+        return encode_image(image, config.image_store_format, config.image_store_quality)
+
+    def nbytes(self):
+        """保持している画像のバイト数を取得するメソッド
+
+        Returns:
+            int: 画像のバイト数
+        """
+        return len(self.image) if self.image else 0
 
 class App:
     """Streamlitアプリの主要な動作を管理するクラス
@@ -47,7 +96,7 @@ class App:
         input_column_width: 入力の列幅
         input_button_column_width: 入力ボタンの列幅
         db: データベースマネージャ
-        pre_session_uploaded_image: 前回セッションでアップロードされた画像
+        submitted_files: 送信済みのアップロード画像のファイルID
         column_width: 列幅
         delete_item_id: 削除するアイテムのID
     """
@@ -55,7 +104,8 @@ class App:
         """初期化メソッド
 
         Args:
-            db (DatabaseManager): データベースマネージャオブジェクト。
+            db (DatabaseManager): データベースマネージャオブジェクト（全セッションで共有）。
+            user_db (UserManager): ユーザマネージャオブジェクト（全セッションで共有）。
         """
         #入力データ関係の初期化
         self.autoinput_image = None
@@ -63,25 +113,30 @@ class App:
         self.input_column_width = [4,3,3,2,1]
         self.input_button_column_width = [4,4,8 ,4] 
 
-        #DB関係の初期化
+        #DB関係の初期化（テーブル作成はプロセス起動時に一回だけ行う）
         self.db = db
-        self.db.create()
 
         self.user_db = user_db
-        self.user_db.create()
         self.new_user = ""
         self.del_user = ""
 
         #画像を画像処理サーバに送信する機能
-        self.pre_session_uploaded_image = None
+        self.submitted_files = set()
+        self.pending_jobs = []
+        self.job_labels = {}
+        self.jobs_total = 0
+        self.job_errors = []
 
         #出力関係
         self.column_width = [4,3,3,3,2]
         self.delete_item_id = []
+        self.pending_image_writes = []
+        self.display_limit = DISPLAY_PAGE_SIZE
 
         #ログイン関係
         self.user = "guest"
 
+    @timed("make_input_data")
     def make_input_data(self, image, data_dict):   
         """画像とデータ辞書から入力データを作成するメソッド
 
@@ -92,61 +147,208 @@ class App:
         Returns:
             list: InputDataオブジェクトのリスト
         """     
+        rows = data_dict["data"]
+        #元画像のデコードは一回だけ行い、全ての切り出しをまとめて作成
+        boxes = [tuple(row['coordinate'].values()) for row in rows]
+        images = ImageProcessor.crop_squares(image, boxes)
+
+        items = []
+        for row, cropped in zip(rows, images):
+            #期限種類
+            if row["type"]:
+                expiry_type = row['type']
+            else:
+                expiry_type = "消費期限"
+            #期限選択
+            if row['date']:
+                expiry_date = datetime.datetime.strptime(row['date'], '%Y-%m-%d').date()
+            else:
+                expiry_date = datetime.date.today()
+
+            item = InputData(
+                image = InputData.encode(cropped),
+                item_name = row["name"],
+                expiry_type = expiry_type,
+                expiry_date = expiry_date
+            )
+            items.append(item)
+        return items
+
+    def detect(self, name, data):
+        """画像を画像処理サーバに送信し、入力データを作成するメソッド
+
+        バックグラウンドのジョブとして実行するため、Streamlitの描画は行わない
+
+        Args:
+            name (str): 画像のファイル名
+            data (bytes): 画像のバイト列
+
+        Returns:
+            list: InputDataオブジェクトのリスト
+        """
+        image = self.to_file(name, data)
+        data_dict = ImageUploader(image).upload()
+        if not data_dict or "data" not in data_dict:
+            return []
+        return self.make_input_data(image, data_dict)
+
+    def detect_many(self, files):
+        """複数の画像を一回のリクエストで送信し、入力データをまとめて作成するメソッド
+
+        Args:
+            files (list): (ファイル名, 画像のバイト列)のタプルのリスト
+
+        Returns:
+            list: InputDataオブジェクトのリスト（画像の順番）
+        """
+        images = [self.to_file(name, data) for name, data in files]
         items = []
-        for row in data_dict["data"]:
-                with Image.open(image) as img:
-                    img = ImageProcessor(img)
-                    xmin,ymin,xmax,ymax = row['coordinate'].values()
-                    img.crop(xmin,ymin,xmax,ymax)
-                    img.square()
-                    #期限種類
-                    if row["type"]:
-                        expiry_type = row['type']
-                    else:
-                        expiry_type = "消費期限"
-                    #期限選択
-                    if row['date']:
-                        expiry_date = datetime.datetime.strptime(row['date'], '%Y-%m-%d').date()
-                    else:
-                        expiry_date = datetime.date.today()
-
-                    item = InputData(
-                        image = img.image,
-                        item_name = row["name"],
-                        expiry_type = expiry_type,
-                        expiry_date = expiry_date
-                    )
-                    items.append(item)
+        for image, data_dict in zip(images, ImageUploader.upload_many(images)):
+            if data_dict and "data" in data_dict:
+                items += self.make_input_data(image, data_dict)
         return items
 
+    @staticmethod
+    def to_file(name, data):
+        """バイト列をファイル名付きのファイルオブジェクトに変換するメソッド
+
+        Args:
+            name (str): ファイル名
+            data (bytes): バイト列
+
+        Returns:
+            io.BytesIO: ファイルオブジェクト
+        """
+        image = io.BytesIO(data)
+        image.name = name
+        return image
+
+    def submit_images(self, images):
+        """アップロードされた画像を処理するジョブを追加するメソッド
+
+        一括送信のパスが設定されている場合はdetection_batch_size枚ずつ一回のリクエストにまとめ、
+        そうでない場合は一枚ずつジョブにする（同時実行数はジョブキューで制限される）
+
+        Args:
+            images (list): アップロードされた画像のリスト
+        """
+        if not self.pending_jobs:
+            self.jobs_total = 0
+        if config.detection_batch_path:
+            size = config.detection_batch_size
+            for start in range(0, len(images), size):
+                chunk = images[start:start + size]
+                files = [(image.name, image.getvalue()) for image in chunk]
+                job_id = job_queue.submit(self.detect_many, files)
+                self.pending_jobs.append(job_id)
+                self.job_labels[job_id] = (", ".join(name for name, _ in files), len(files))
+        else:
+            for image in images:
+                job_id = job_queue.submit(self.detect, image.name, image.getvalue())
+                self.pending_jobs.append(job_id)
+                self.job_labels[job_id] = (image.name, 1)
+        self.jobs_total += len(images)
+
+    def collect_jobs(self):
+        """完了したジョブの結果を入力データに追加するメソッド
+
+        Returns:
+            bool: 完了したジョブがあった場合はTrue
+        """
+        finished = [job_id for job_id in self.pending_jobs if job_queue.done(job_id)]
+        for job_id in finished:
+            self.pending_jobs.remove(job_id)
+            label, _ = self.job_labels.pop(job_id, (job_id, 0))
+            future = job_queue.pop(job_id)
+            if future is None:
+                self.job_errors.append(f"{label} の処理結果は保持期間を過ぎたため破棄されました。もう一度アップロードして下さい")
+                continue
+            try:
+                items = future.result()
+            except Exception as e:
+                self.job_errors.append(str(e))
+                continue
+            skipped = self.add_input_data(items)
+            if skipped:
+                self.job_errors.append(f"入力欄が上限に達したため、{skipped}件を追加しませんでした")
+        return bool(finished)
+
+    def add_input_data(self, items):
+        """セッションごとの上限の範囲で入力データを追加するメソッド
+
+        入力欄の数と保持する画像の合計バイト数がconfigの上限を超えないようにする
+
+        Args:
+            items (list): 追加するInputDataオブジェクトのリスト
+
+        Returns:
+            int: 上限を超えたため追加しなかった件数
+        """
+        size = sum(row.nbytes() for row in self.input_data)
+        added = 0
+        for item in items:
+            if len(self.input_data) >= config.input_max_rows or size + item.nbytes() > config.input_max_image_bytes:
+                break
+            self.input_data.append(item)
+            size += item.nbytes()
+            added += 1
+        return len(items) - added
+
+    @st.fragment(run_every=config.job_poll_interval)
+    def job_status(self):
+        """写真ごとの処理状況を表示し、完了したら画面全体を再描画するメソッド"""
+        if self.collect_jobs():
+            st.rerun()
+        remaining = sum(count for _, count in self.job_labels.values())
+        done = max(self.jobs_total - remaining, 0)
+        st.progress(done / max(self.jobs_total, 1), text=f"写真を処理中です（{done}/{self.jobs_total}枚完了）")
+        for label, _ in self.job_labels.values():
+            st.caption(f"処理中: {label}")
+
     def autoinput(self):
-        """画像をアップロードして消費期限を自動入力するメソッド"""
+        """画像をアップロードして消費期限を自動入力するメソッド
+
+        画像の送信と切り出しはバックグラウンドのジョブで行い、完了したものから入力データに追加する
+        """
+        self.collect_jobs()
+        self.server_warning("food-expiration")
         columns = st.columns([6,3])
         with columns[0]:
-            image = st.file_uploader("写真をアップロードすると消費期限が自動で入力されます", type=AVAILABLE_IMAGE_TYPE, key='auto_uploader')
-
-            if ((image and not self.pre_session_uploaded_image) or #前回は画像がなかったが今回は画像がある
-                (image and self.pre_session_uploaded_image and image!=self.pre_session_uploaded_image)):#前回と今回と画像が異なる
-               
-                #ファイルをサーバーへ転送
-                uploader = ImageUploader(image)
-                try:
-                    data_dict = uploader.upload()
-                except Exception as e:
-                    st.text("a")
-                    st.error(f"エラー: {str(e)}")
-                    data_dict = {}
-
-                if "data" in data_dict.keys(): 
-                    #入力データ更新
-                    self.input_data = self.make_input_data(image, data_dict)
-      
-                self.autoinput_image = image
-            self.pre_session_uploaded_image = image
+            images = st.file_uploader("写真をアップロードすると消費期限が自動で入力されます（複数枚可）", type=AVAILABLE_IMAGE_TYPE,
+                                      key='auto_uploader', accept_multiple_files=True)
+
+            #前回までに送信していない画像だけをサーバーへ転送するジョブを追加
+            file_ids = {image.file_id: image for image in images}
+            new_images = [image for file_id, image in file_ids.items() if file_id not in self.submitted_files]
+            if new_images:
+                self.submit_images(new_images)
+                self.autoinput_image = new_images
+            #アップローダーから外された画像は、再度追加された場合に送信し直す
+            self.submitted_files = set(file_ids)
+
+            for error in self.job_errors:
+                st.error(f"エラー: {error}")
+            self.job_errors = []
+            if self.pending_jobs:
+                self.job_status()
                 
         with columns[1]:
             if self.autoinput_image:
-                st.image(self.autoinput_image, use_column_width =True)
+                st.image(self.autoinput_image, use_column_width =True,
+                         caption=[image.name for image in self.autoinput_image])
+
+    def server_warning(self, endpoint):
+        """推論サーバーに接続できない間、その旨を表示するメソッド
+
+        Args:
+            endpoint (str): エンドポイント名
+        """
+        if get_client().available(endpoint):
+            return
+        if config.degraded_mode:
+            st.warning("推論サーバーに接続できません。以前に処理した画像・食材の結果のみ表示します")
+        else:
+            st.warning("推論サーバーに接続できません")
 
     def input(self):    
         """入力フォームを表示するメソッド""" 
@@ -157,91 +359,179 @@ class App:
             self.register()
         # 入力データ追加
         with button_columns[1]:
-            if st.button("入力欄追加"):
-                self.input_data.append(InputData())
+            if st.button("入力欄追加") and self.add_input_data([InputData()]):
+                st.warning(f"入力欄は{config.input_max_rows}件までです")
         #削除
         with button_columns[3]:
             if st.button("削除実行"):
                 #無効なデータは全て削除
                 self.input_data = [row for row in self.input_data if row.enable]
 
-        #入力データを表示
-        for i, row in enumerate(self.input_data):
-            st.markdown("---") 
-            new_image = st.file_uploader("画像変更", type=AVAILABLE_IMAGE_TYPE, key=f"uploader_{i}")
-            if new_image:
-                with Image.open(new_image) as img:
-                    row.image = ImageProcessor(img).square().image
-            columns = st.columns(self.input_column_width)
-            with columns[4]:
-                state = st.checkbox("削除",key={f"delete_{row.id}"})
-                row.enable = not state
-
-            #i行目の入力データを表示
-            with columns[0]:
-                if row.image:
-                    st.image(row.image)         
-            with columns[1]:
-                row.item_name = st.text_input("品名", value=row.item_name ,key=f"name_{i}")
-            with columns[2]:
-                row.expiry_type = st.selectbox("期限種類", ["消費期限", "賞味期限"], index=EXPIRY_TYPE_DICT[row.expiry_type], key=f'type_{i}')
-            with columns[3]:
-                row.expiry_date = st.date_input("期限", value=row.expiry_date, key=f'date_{i}')
+        #入力データを表示（行ごとに部分的に再実行する）
+        for row in self.input_data:
+            self.input_row(row)
+
+    @st.fragment
+    def input_row(self, row):
+        """入力データを一行分表示するメソッド
+
+        ウィジェットのキーは行のIDから作り、行の削除で他の行の入力がずれないようにする。
+        画像はアップロードされたファイルが変わった場合だけ処理する。
+
+        Args:
+            row (InputData): 表示する入力データ
+        """
+        st.markdown("---")
+        new_image = st.file_uploader("画像変更", type=AVAILABLE_IMAGE_TYPE, key=f"uploader_{row.id}")
+        if new_image and new_image.file_id != row.image_source:
+            with Image.open(new_image) as img:
+                row.image = InputData.encode(ImageProcessor(img).square().image)
+            row.image_source = new_image.file_id
+        columns = st.columns(self.input_column_width)
+        with columns[4]:
+            state = st.checkbox("削除", key=f"delete_{row.id}")
+            row.enable = not state
+
+        with columns[0]:
+            if row.image:
+                st.image(row.image)
+        with columns[1]:
+            row.item_name = st.text_input("品名", value=row.item_name, key=f"name_{row.id}")
+        with columns[2]:
+            row.expiry_type = st.selectbox("期限種類", ["消費期限", "賞味期限"], index=EXPIRY_TYPE_DICT[row.expiry_type], key=f"type_{row.id}")
+        with columns[3]:
+            row.expiry_date = st.date_input("期限", value=row.expiry_date, key=f"date_{row.id}")
 
     def register(self):
         """データをデータベースに登録するメソッド"""
 
         if st.button("登録"):
-            for row in self.input_data:
-               #データベースに追加
-                new_id = self.db.insert(self.user, row.item_name, row.expiry_type, row.expiry_date)
-                #画像をimageフォルダへ保存
-                if row.image:
-                    image_path = os.path.join(self.db.image_dir, f"{new_id}.png")
-                    row.image.save(image_path, 'PNG')
+            #データベースに一括で追加
+            new_ids = self.db.insert_many(
+                self.user,
+                [(row.item_name, row.expiry_type, row.expiry_date) for row in self.input_data]
+            )
+            #画像をimageフォルダへ保存（コミット後にバックグラウンドで実行）
+            self.pending_image_writes += self.db.save_images(
+                new_ids, [row.image for row in self.input_data]
+            )
 
             #入力データリセット
             self.input_data = []
 
-    def colored_write(self,expiry_date):
+    def colored_write(self,expiry_date,status):
         """期限に基づいて色分けされたテキストを表示するメソッド
 
         Args:
             expiry_date (str): 期限の日付
+            status (str): 期限の状態（EXPIRY_STATUSESのキー）
         """
-        expiry_date = datetime.datetime.strptime(expiry_date, '%Y-%m-%d').date()
-        remaining = (expiry_date - datetime.date.today()).days
-
-        if remaining < 0:
-            color, text_color =  '#FF6666', "#000000"
-        elif remaining == 0:
-            color, text_color = '#FFA500', "#000000"
-        elif remaining <= 3:
-            color, text_color = '#FFFF66', "#000000"
-        else:
-            color, text_color = "", ""
+        _, color, text_color = EXPIRY_STATUSES[status]
 
         colored_text = f"<div style='background-color:{color}; color:{text_color};'>{expiry_date}</div>"
         st.markdown(colored_text, unsafe_allow_html=True)
 
+    @timed("display_thumbnails")
+    def thumbnails(self, ids):
+        """商品画像のサムネイルをまとめて取得するメソッド
+
+        Args:
+            ids (list): 商品データのID
+
+        Returns:
+            dict: IDごとのエンコード済みのサムネイル。画像がないIDは含まない
+        """
+        image_store = self.db.image_store
+        thumbnails = {}
+        for id, version in image_store.versions(ids).items():
+            thumbnail = thumbnail_cache.get(id, version, lambda id=id: image_store.load(id))
+            if thumbnail:
+                thumbnails[id] = thumbnail
+        return thumbnails
+
+    def display_table(self, products):
+        """登録データを一つの表として表示し、チェックした行をまとめて削除するメソッド
+
+        Args:
+            products (pandas.DataFrame): 期限の状態を計算済みの商品データ
+        """
+        thumbnails = self.thumbnails(products["id"].tolist())
+        table = pd.DataFrame({
+            "画像": [data_uri(thumbnails[id]) if id in thumbnails else None for id in products["id"]],
+            "品名": products["item_name"],
+            "期限種類": products["expiry_type"],
+            "期限": products["expiry_date"],
+            "状態": [EXPIRY_STATUSES[status][0] for status in products["status"]],
+            "削除": False,
+        }, index=products["id"])
+
+        edited = st.data_editor(
+            table,
+            column_config={
+                "画像": st.column_config.ImageColumn("画像"),
+                "削除": st.column_config.CheckboxColumn("削除"),
+            },
+            disabled=["画像", "品名", "期限種類", "期限", "状態"],
+            hide_index=True,
+            key=f"display_table_{self.user}",
+        )
+        if st.button("削除実行", key="display_table_delete_button"):
+            self.db.delete_many(edited.index[edited["削除"]].tolist())
+            st.rerun()
+
+    def display_grouped(self, products):
+        """登録データを期限の状態ごとに表にまとめて表示するメソッド
+
+        Args:
+            products (pandas.DataFrame): 期限の状態を計算済みの商品データ
+        """
+        columns = {"item_name": "品名", "expiry_type": "期限種類", "expiry_date": "期限", "remaining": "残り日数"}
+        for status, (label, color, text_color) in EXPIRY_STATUSES.items():
+            bucket = products[products["status"] == status]
+            if bucket.empty:
+                continue
+            st.subheader(f"{label}（{len(bucket)}件）")
+            table = bucket[list(columns)].rename(columns=columns)
+            style = f"background-color: {color}; color: {text_color};" if color else ""
+            st.dataframe(
+                table.style.apply(lambda col: [style] * len(col), subset=["期限"]),
+                hide_index=True,
+            )
+
     def display(self):
         """登録データを表示するメソッド"""
         if st.button("削除実行",key="display_delete_button"):
-            for id in self.delete_item_id:
-                self.db.delete(id)
+            self.db.delete_many(self.delete_item_id)
             
         #削除候補をリセット
         self.delete_item_id = []
 
-        #データベースから画像を引っ張ってきて表示
-        for i, row in enumerate(self.db.fetch_all_products(self.user)):
+        #登録直後の画像保存が終わるまで待つ
+        if self.pending_image_writes:
+            concurrent.futures.wait(self.pending_image_writes)
+            self.pending_image_writes = []
+
+        products = self.db.fetch_all_products(self.user)
+        #期限の状態は全行まとめて計算する
+        statuses = add_expiry_status(products_frame(products))
+        mode = st.radio("表示形式", DISPLAY_MODES, horizontal=True, key="display_mode")
+        if mode == "期限ごと":
+            self.display_grouped(statuses)
+            return
+        if mode == "表":
+            self.display_table(statuses)
+            return
+
+        #データベースから画像を引っ張ってきて表示（表示件数を超える行は読み込まない）
+        thumbnails = self.thumbnails([row["id"] for row in products[:self.display_limit]])
+        for i, row in enumerate(products[:self.display_limit]):
             st.markdown("---") 
             columns = st.columns(self.column_width)
             
             #画像表示
-            image_path = os.path.join(self.db.image_dir, f"{row['id']}.png")
-            if os.path.exists(image_path):
-                columns[0].image(Image.open(image_path))
+            thumbnail = thumbnails.get(row['id'])
+            if thumbnail:
+                columns[0].image(thumbnail)
             else:
                 # 50pxの高さの空のスペースを確保する
                 columns[0].markdown('<div style="height:150px;"></div>', unsafe_allow_html=True)  
@@ -251,13 +541,21 @@ class App:
             columns[2].write(row["expiry_type"])
             #期限
             with columns[3]:
-                self.colored_write(row["expiry_date"])
+                self.colored_write(row["expiry_date"], statuses["status"].iat[i])
             #削除用チェックボックス
             with columns[4]:
                 if st.checkbox("削除",key={f"delete_{row['id']}"}):
                     self.delete_item_id.append(row["id"])
+
+        #残りの行は次のページとして読み込む
+        if len(products) > self.display_limit:
+            st.markdown("---")
+            if st.button(f"さらに表示（残り{len(products) - self.display_limit}件）", key="display_more_button"):
+                self.display_limit += DISPLAY_PAGE_SIZE
+                st.rerun()
     
     def dish(self):
+        self.server_warning("propose_dish")
         purpose = st.selectbox("食事の目的", ["夕食", "昼食", "朝食", "おやつ"], key="シチュエーション")
         if st.button("提案"):
             ing_list  = []
@@ -269,28 +567,66 @@ class App:
                 ))
             ingredients = Ingredients(
                 食材リスト = ing_list,
-                目的= "夕食"
+                目的= purpose
             )
         
             dishpropopser = DishProposer()
             try:
-                dishes = dishpropopser.proposal(ingredients)
+                if config.proposal_stream:
+                    #受け取った料理から順に表示する
+                    with timer("dish_proposal_stream"):
+                        for i, item in enumerate(dishpropopser.stream(ingredients)):
+                            self.write_dish(i, item)
+                else:
+                    dishes = dishpropopser.proposal(ingredients)
+                    if not isinstance(dishes, dict) or "Dishes" not in dishes:
+                        st.error("料理の提案を取得できませんでした")
+                        return
+                    for i, item in enumerate(dishes["Dishes"]):
+                        self.write_dish(i, item)
             except Exception as e:
                 st.error(f"エラー: {str(e)}")
-                dishes = None
 
-            for i, item in enumerate(dishes["Dishes"]):
-                dish =item["dish"]
-                ings = item["ingredients"]
-                steps = item["steps"]
+    def write_dish(self, i, item):
+        """提案された料理を一件表示するメソッド
 
-                st.header(f"料理{i+1}: {dish}")
-                st.subheader("食材")
-                st.write(', '.join(ings))
-                st.subheader(f"手順")
-                for i,x in enumerate(steps):
-                    st.write(f"{i+1}: {x}")
-                st.markdown("---")
+        Args:
+            i (int): 料理の番号（0始まり）
+            item (dict): 料理一件分のデータ
+        """
+        dish =item["dish"]
+        ings = item["ingredients"]
+        steps = item["steps"]
+
+        st.header(f"料理{i+1}: {dish}")
+        st.subheader("食材")
+        st.write(', '.join(ings))
+        st.subheader(f"手順")
+        for i,x in enumerate(steps):
+            st.write(f"{i+1}: {x}")
+        st.markdown("---")
+
+    def register_view(self):
+        """登録画面を表示するメソッド"""
+        #写真入力フォーム
+        self.autoinput()
+
+        #入力フォーム
+        st.markdown("---") 
+        self.input()
+
+    def views(self):
+        """画面名と画面を表示するメソッドの対応を取得するメソッド
+
+        Returns:
+            dict: 画面名ごとの表示メソッド（表示順）
+        """
+        return {
+            "登録": self.register_view,
+            "表示": self.display,
+            "料理提案": self.dish,
+            "ユーザ切替": self.login,
+        }
 
     def login(self):
         """ユーザ切替画面を表示するメソッド"""
@@ -312,23 +648,82 @@ class App:
         #ユーザ削除
         if st.button("削除",key='user_delete'):
             if self.del_user:
+                self.db.delete_user_products(self.del_user)
                 self.user_db.delete(self.del_user)
                 records = self.user_db.get_users()
                 self.users = [r["name"] for r in records]
         self.del_user = st.selectbox('削除するユーザ',self.users)
 
-        #ユーザ選択
-        self.user = user_selection.selectbox('ユーザを選択して下さい',self.users)
+        #ユーザ選択（他の画面を表示している間はウィジェットの状態が破棄されるため、選択中のユーザを初期値にする）
+        index = self.users.index(self.user) if self.user in self.users else 0
+        self.user = user_selection.selectbox('ユーザを選択して下さい',self.users,index=index)
 
     
+def render_view(view, panel):
+    """画面を表示し、処理時間を記録する関数
+
+    Args:
+        view (callable): 画面を表示するメソッド
+        panel (callable): 処理時間の内訳を表示する場所を返す関数
+    """
+    metrics.start_rerun()
+    with timer(f"view_{view.__name__}"):
+        view()
+    if config.debug_panel:
+        show_debug_panel(panel())
+
+
+def show_debug_panel(container):
+    """直近の再実行での処理時間の内訳と全体の集計を表示する関数
+
+    Args:
+        container: 表示先のStreamlitのコンテナ
+    """
+    with container:
+        st.subheader("処理時間")
+        breakdown = metrics.rerun_breakdown()
+        st.dataframe(
+            pd.DataFrame(breakdown, columns=["処理", "秒"]).style.format({"秒": "{:.4f}"}),
+            hide_index=True,
+        )
+        st.json(metrics.snapshot(), expanded=False)
+
+
+@st.cache_resource
+def get_shared_resources():
+    """全セッションで共有するデータベースマネージャを作成する関数
+
+    プロセスで一回だけ実行され、テーブルの作成・期限通知の開始・スタンドインサーバーの起動もここで行う
+
+    Returns:
+        tuple: (DatabaseManager, UserManager)
+    """
+    #推論サーバーの代わりにスタンドインサーバーを起動
+    if config.standin_server:
+        server = standin_server.start_server(latency=config.standin_latency,
+                                             failure_rate=config.standin_failure_rate)
+        config.server_ip = f"127.0.0.1:{server.server_address[1]}"
+    db = DatabaseManager()
+    db.create()
+    user_db = UserManager()
+    user_db.create()
+    #処理時間の集計を返すサーバーを起動
+    if config.metrics_port:
+        start_server(config.metrics_port)
+    #期限が近い商品の通知を開始
+    if config.notify_sink:
+        ExpiryScheduler(db, make_sink(config.notify_sink),
+                        expired_days=config.notify_expired_days, notify_hour=config.notify_hour).start()
+    return db, user_db
+
+
 if __name__ == "__main__":
     #プログラム実行時に最初に一回だけ実行
     if 'initialized' not in st.session_state:
         st.session_state.initialized = False
     if not st.session_state.initialized:
-        #最初に一回だけ実行
-        db = DatabaseManager()
-        user_db = user_manager = UserManager()
+        #最初に一回だけ実行（セッションごとに持つのは入力フォームの状態のみ）
+        db, user_db = get_shared_resources()
         st.session_state.app = App(db, user_db)
         st.session_state.initialized = True
 
@@ -336,30 +731,24 @@ if __name__ == "__main__":
     st.set_page_config(layout="wide")
     st.title("消費期限管理アプリ")
 
-    tabs = st.tabs(["登録","表示","料理提案","ユーザ切替"])
-    
-    with tabs[3]:
-        #ユーザ切り替え
-        st.session_state.app.login()
-
-    with tabs[0]:
-        #写真入力フォーム
-        st.session_state.app.autoinput()
-
-        #入力フォーム
-        st.markdown("---") 
-        st.session_state.app.input()
-
-    with tabs[1]:
-    #登録データの表示
-        #st.subheader("登録データ一覧")
-        st.session_state.app.display()   
-
-    with tabs[2]:
-        #料理提案
-        st.session_state.app.dish()
-
-
-
-
-
+    app = st.session_state.app
+    views = app.views()
+    if config.navigation == "tabs":
+        #全てのタブを毎回描画する
+        tabs = dict(zip(views, st.tabs(list(views))))
+        #ユーザ切り替えを最初に実行し、他のタブに選択中のユーザを反映する
+        metrics.start_rerun()
+        for name in ["ユーザ切替", "登録", "表示", "料理提案"]:
+            with tabs[name]:
+                with timer(f"view_{views[name].__name__}"):
+                    views[name]()
+        if config.debug_panel:
+            show_debug_panel(st.sidebar)
+    else:
+        #選択中の画面だけを描画し、画面内の操作はその画面だけを再実行する
+        selected = st.radio("画面", list(views), horizontal=True, key="navigation", label_visibility="collapsed")
+        #登録画面以外を表示している間も完了したジョブを受け取り、結果が破棄されないようにする
+        if selected != "登録" and app.pending_jobs:
+            st.fragment(app.collect_jobs, run_every=config.job_poll_interval)()
+        #フラグメント内からはサイドバーに書き込めないため、内訳は画面の下に表示する
+        st.fragment(render_view)(views[selected], lambda: st.expander("処理時間（デバッグ）"))
@@ -0,0 +1,180 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheusのメトリクス名の接頭辞
+METRIC_PREFIX = "food_client"
+
+
+class Metrics:
+    """処理時間とカウンタを集計するクラス
+
+    処理時間は名前ごとに回数・合計・最大を全スレッド分集計する。
+    加えて、スクリプトの実行スレッドごとに直近の再実行での内訳を記録する。
+    """
+    def __init__(self):
+        """初期化メソッド"""
+        self._timings = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def timer(self, name):
+        """withブロックの処理時間を記録するコンテキストマネージャ
+
+        Args:
+            name (str): メトリクス名
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """関数の処理時間を記録するデコレータ
+
+        Args:
+            name (str): メトリクス名
+
+        Returns:
+            callable: デコレータ
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds):
+        """処理時間を記録するメソッド
+
+        Args:
+            name (str): メトリクス名
+            seconds (float): 処理時間の秒数
+        """
+        with self._lock:
+            count, total, maximum = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+        rerun = getattr(self._local, "rerun", None)
+        if rerun is not None:
+            rerun.append((name, seconds))
+
+    def increment(self, name, value=1):
+        """カウンタを増やすメソッド
+
+        Args:
+            name (str): メトリクス名
+            value (int): 増やす値
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def start_rerun(self):
+        """現在のスレッドで再実行ごとの内訳の記録を開始するメソッド"""
+        self._local.rerun = []
+
+    def rerun_breakdown(self):
+        """現在のスレッドの直近の再実行での処理時間の内訳を取得するメソッド
+
+        Returns:
+            list: (メトリクス名, 秒数)のタプルのリスト（記録順）
+        """
+        return list(getattr(self._local, "rerun", None) or [])
+
+    def snapshot(self):
+        """集計結果を取得するメソッド
+
+        Returns:
+            dict: "timings"に名前ごとの回数・合計・最大、"counters"にカウンタの値
+        """
+        with self._lock:
+            timings = {name: {"count": count, "sum": total, "max": maximum}
+                       for name, (count, total, maximum) in self._timings.items()}
+            counters = dict(self._counters)
+        return {"timings": timings, "counters": counters}
+
+    def to_json(self):
+        """集計結果をJSONで出力するメソッド
+
+        Returns:
+            str: JSON文字列
+        """
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """集計結果をPrometheusのテキスト形式で出力するメソッド
+
+        Returns:
+            str: Prometheusのテキスト形式の文字列
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, timing in sorted(snapshot["timings"].items()):
+            metric = f"{METRIC_PREFIX}_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"{metric}_count {timing['count']}")
+            lines.append(f"{metric}_sum {timing['sum']:.6f}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            lines.append(f"{metric}_max {timing['max']:.6f}")
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# 全セッションで共有する集計
+metrics = Metrics()
+timer = metrics.timer
+timed = metrics.timed
+increment = metrics.increment
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics（Prometheus形式）と/metrics.json（JSON形式）を返すハンドラ"""
+
+    def do_GET(self):
+        """GETリクエストを処理するメソッド"""
+        if self.path == "/metrics":
+            body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = metrics.to_json(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """アクセスログを出力しないためのメソッド"""
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port):
+    """メトリクスを返すHTTPサーバーをバックグラウンドで起動する関数
+
+    すでに起動している場合は何もしない
+
+    Args:
+        port (int): 待ち受けるポート番号
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return
+        _server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
@@ -0,0 +1,269 @@
+import datetime
+import json
+import logging
+import threading
+from collections import defaultdict
+import config
+from db_utils import add_insert_listener
+from expiry_utils import SOON_DAYS, EXPIRY_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# notify_stateテーブルで期限通知の送信日を記録する名前
+NOTIFY_STATE_NAME = "expiry_digest"
+
+
+class LogSink:
+    """期限通知をログに出力するクラス"""
+
+    def emit(self, digest):
+        """通知をログに出力するメソッド
+
+        Args:
+            digest (dict): ユーザごとの期限通知
+        """
+        counts = ", ".join(f"{EXPIRY_STATUSES[status][0]}: {len(digest[status])}件"
+                           for status in ("expired", "today", "soon"))
+        logger.info("%s %s さんの期限通知 (%s)", digest["date"], digest["user"], counts)
+
+
+class FileSink:
+    """期限通知をJSON Lines形式でファイルに追記するクラス
+
+    Attributes:
+        path (str): 出力先のファイルのパス
+    """
+
+    def __init__(self, path):
+        """初期化メソッド
+
+        Args:
+            path (str): 出力先のファイルのパス
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, digest):
+        """通知をファイルに追記するメソッド
+
+        Args:
+            digest (dict): ユーザごとの期限通知
+        """
+        line = json.dumps(digest, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class WebhookSink:
+    """期限通知をWebhookにPOSTするクラス
+
+    Attributes:
+        url (str): 送信先のURL
+    """
+
+    def __init__(self, url):
+        """初期化メソッド
+
+        Args:
+            url (str): 送信先のURL
+        """
+        self.url = url
+
+    def emit(self, digest):
+        """通知をJSONで送信するメソッド
+
+        Args:
+            digest (dict): ユーザごとの期限通知
+        """
+        from http_client import get_client
+        get_client().post("notify", self.url, json=digest, timeout=(config.connect_timeout, 10))
+
+
+def make_sink(spec):
+    """設定の文字列から通知先を作成する関数
+
+    Args:
+        spec (str): log、file:<パス>、webhook:<URL>のいずれか
+
+    Returns:
+        LogSink | FileSink | WebhookSink: 通知先
+    """
+    kind, _, target = spec.partition(":")
+    if kind == "file":
+        return FileSink(target)
+    if kind == "webhook":
+        return WebhookSink(target)
+    return LogSink()
+
+
+class ExpiryScheduler:
+    """期限が近い・今日まで・期限切れの商品をユーザごとにまとめて通知するクラス
+
+    期限の日付のインデックスを使い、各シャードから通知の対象になる範囲だけを読み込む。
+    次に通知が必要になる日時までスレッドを停止し、定期的に全件を確認することはしない。
+    通知した日付はユーザテーブルと同じDBに記録し、再起動しても同じ日の通知を二重に送らない。
+
+    Attributes:
+        db (DatabaseManager): 商品データのデータベースマネージャ
+        sink: 通知先（emitメソッドを持つオブジェクト）
+        expired_days (int): 期限切れの商品を通知し続ける日数
+        notify_hour (int): 通知する時刻（時）
+    """
+
+    def __init__(self, db, sink, expired_days=7, notify_hour=8):
+        """初期化メソッド
+
+        Args:
+            db (DatabaseManager): 商品データのデータベースマネージャ
+            sink: 通知先
+            expired_days (int): 期限切れの商品を通知し続ける日数
+            notify_hour (int): 通知する時刻（時）
+        """
+        self.db = db
+        self.sink = sink
+        self.expired_days = expired_days
+        self.notify_hour = notify_hour
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def window(self, date):
+        """指定した日の通知の対象になる期限の範囲を取得するメソッド
+
+        Args:
+            date (datetime.date): 通知する日
+
+        Returns:
+            tuple: (最も古い期限の日付, 最も新しい期限の日付)の文字列
+        """
+        first = date - datetime.timedelta(days=self.expired_days)
+        last = date + datetime.timedelta(days=SOON_DAYS)
+        return first.isoformat(), last.isoformat()
+
+    def digests(self, date):
+        """指定した日の期限通知をユーザごとに作成するメソッド
+
+        Args:
+            date (datetime.date): 通知する日
+
+        Returns:
+            list: ユーザごとの期限通知
+        """
+        rows = []
+        for shard in self.db.shard_numbers():
+            cursor = self.db.connect(shard).cursor()
+            cursor.execute('''SELECT user_id, item_name, expiry_type, expiry_date FROM product
+                            WHERE expiry_date BETWEEN ? AND ? ORDER BY expiry_date, id''', self.window(date))
+            rows += cursor.fetchall()
+        #ユーザIDでまとめ、削除済みのユーザの商品は通知しない
+        names = {row["id"]: row["name"] for row in self.db.user_db.get_users()}
+        users = defaultdict(lambda: {"expired": [], "today": [], "soon": []})
+        today = date.isoformat()
+        for row in rows:
+            if row["user_id"] not in names:
+                continue
+            status = "expired" if row["expiry_date"] < today else "today" if row["expiry_date"] == today else "soon"
+            users[row["user_id"]][status].append(
+                {"item_name": row["item_name"], "expiry_type": row["expiry_type"], "expiry_date": row["expiry_date"]})
+        return [dict(date=today, user=names[user_id], **items) for user_id, items in users.items()]
+
+    def next_date(self, date):
+        """指定した日の次に通知が必要になる日を取得するメソッド
+
+        翌日の通知範囲に商品があれば翌日、なければ範囲外で最も期限が早い商品が範囲に入る日
+
+        Args:
+            date (datetime.date): 基準日
+
+        Returns:
+            datetime.date: 次に通知する日。通知する商品がない場合はNone
+        """
+        tomorrow = date + datetime.timedelta(days=1)
+        first, last = self.window(tomorrow)
+        earliest = None
+        for shard in self.db.shard_numbers():
+            cursor = self.db.connect(shard).cursor()
+            if cursor.execute("SELECT 1 FROM product WHERE expiry_date BETWEEN ? AND ? LIMIT 1", (first, last)).fetchone():
+                return tomorrow
+            row = cursor.execute("SELECT MIN(expiry_date) FROM product WHERE expiry_date > ?", (last,)).fetchone()
+            if row[0] is not None and (earliest is None or row[0] < earliest):
+                earliest = row[0]
+        if earliest is None:
+            return None
+        return datetime.date.fromisoformat(earliest) - datetime.timedelta(days=SOON_DAYS)
+
+    def claim(self, date):
+        """指定した日の通知を送信済みとして記録するメソッド
+
+        送信前に記録するため、複数のプロセスや再起動後に同じ日の通知を送るのは最初の一回だけになる
+
+        Args:
+            date (datetime.date): 通知する日
+
+        Returns:
+            bool: 記録できた（まだ送信していなかった）場合はTrue
+        """
+        with self.db.connect() as conn:
+            cursor = conn.execute('''INSERT INTO notify_state (name, last_date) VALUES (?, ?)
+                                    ON CONFLICT(name) DO UPDATE SET last_date = excluded.last_date
+                                    WHERE last_date < excluded.last_date''', (NOTIFY_STATE_NAME, date.isoformat()))
+            return cursor.rowcount == 1
+
+    def run_once(self, now=None):
+        """今日の通知が未送信であれば送信し、次に起動する日時を返すメソッド
+
+        Args:
+            now (datetime.datetime): 現在日時。Noneの場合は現在の日時
+
+        Returns:
+            datetime.datetime: 次に起動する日時。通知する商品がない場合はNone
+        """
+        now = now or datetime.datetime.now()
+        today = now.date()
+        notify_at = datetime.datetime.combine(today, datetime.time(self.notify_hour))
+        if now < notify_at:
+            return notify_at
+        if self.claim(today):
+            for digest in self.digests(today):
+                try:
+                    self.sink.emit(digest)
+                except Exception:
+                    logger.exception("期限通知の送信に失敗しました")
+        next_date = self.next_date(today)
+        if next_date is None:
+            return None
+        return datetime.datetime.combine(next_date, datetime.time(self.notify_hour))
+
+    def reschedule(self, db_path=None):
+        """商品の追加などで次の通知日時が変わった場合にスレッドを起こすメソッド
+
+        Args:
+            db_path (str): 変更されたデータベースのパス。Noneの場合は常に起こす
+        """
+        if db_path is None or db_path == self.db.db_path:
+            self._wake.set()
+
+    def start(self):
+        """バックグラウンドで通知を行うスレッドを起動するメソッド"""
+        if self._thread is None:
+            add_insert_listener(self.reschedule)
+            self._thread = threading.Thread(target=self._run, name="expiry-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """通知を行うスレッドを停止するメソッド"""
+        self._stopped = True
+        self._wake.set()
+
+    def _run(self):
+        """次の通知日時まで待機しながら通知を繰り返すメソッド"""
+        while not self._stopped:
+            self._wake.clear()
+            try:
+                wake_at = self.run_once()
+            except Exception:
+                logger.exception("期限通知の処理に失敗しました")
+                wake_at = datetime.datetime.now() + datetime.timedelta(hours=1)
+            #通知する商品がない場合は、商品が追加されるまで待機する
+            timeout = None if wake_at is None else max((wake_at - datetime.datetime.now()).total_seconds(), 0)
+            self._wake.wait(timeout)
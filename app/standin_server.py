@@ -0,0 +1,273 @@
+"""推論サーバーの代わりに固定の応答を返すスタンドインサーバー
+
+/food-expiration/ と /propose_dish/ を実装し、同じ入力には常に同じ応答を返す。
+GPUのない環境での動作確認や負荷試験に使い、遅延と失敗を設定で注入できる。
+
+実行例:
+    python app/standin_server.py --port 8000 --latency 0.5 --failure-rate 0.1
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+# 検出結果に使う(商品名, 期限の種類)
+FOODS = [
+    ("牛乳", "消費期限"), ("卵", "賞味期限"), ("豆腐", "消費期限"), ("納豆", "賞味期限"),
+    ("ヨーグルト", "賞味期限"), ("鶏むね肉", "消費期限"), ("食パン", "消費期限"),
+    ("ハム", "消費期限"), ("チーズ", "賞味期限"), ("キャベツ", "消費期限"),
+]
+# 料理名に使う調理法
+DISH_STYLES = ["炒め", "スープ", "サラダ", "煮物", "オムレツ", "丼"]
+
+
+def seeded_random(*parts):
+    """入力の内容から決まる乱数生成器を作成する関数
+
+    Args:
+        *parts: 乱数の種にするバイト列
+
+    Returns:
+        random.Random: 乱数生成器
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+    return random.Random(h.digest())
+
+
+def parse_multipart(content_type, body):
+    """multipart/form-dataのリクエストをフィールドごとに分割する関数
+
+    Args:
+        content_type (str): Content-Typeヘッダ
+        body (bytes): リクエストの本文
+
+    Returns:
+        list: (フィールド名, バイト列)のタプルのリスト
+    """
+    message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+    if not message.is_multipart():
+        return []
+    return [(part.get_param("name", header="content-disposition"), part.get_payload(decode=True))
+            for part in message.get_payload()]
+
+
+def detect(data, boxes, base_date):
+    """画像の内容から決まる検出結果を作成する関数
+
+    Args:
+        data (bytes): 画像のバイト列
+        boxes (int): 検出する商品の数
+        base_date (datetime.date): 期限の基準日
+
+    Returns:
+        dict: /food-expiration/の応答データ
+
+    Raises:
+        PIL.UnidentifiedImageError: 画像として読み込めない場合
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+    rng = seeded_random(data)
+    rows = []
+    for _ in range(boxes):
+        name, expiry_type = rng.choice(FOODS)
+        box_width = rng.randint(max(width // 8, 1), max(width // 3, 1))
+        box_height = rng.randint(max(height // 8, 1), max(height // 3, 1))
+        xmin = rng.randint(0, width - box_width)
+        ymin = rng.randint(0, height - box_height)
+        rows.append({
+            "name": name,
+            "type": expiry_type,
+            "date": (base_date + datetime.timedelta(days=rng.randint(-2, 14))).isoformat(),
+            "coordinate": {"xmin": xmin, "ymin": ymin, "xmax": xmin + box_width, "ymax": ymin + box_height},
+        })
+    return {"data": rows}
+
+
+def propose(request):
+    """食材リストと目的から決まる料理の提案を作成する関数
+
+    Args:
+        request (dict): /propose_dish/のリクエストデータ
+
+    Returns:
+        list: 料理のリスト
+    """
+    names = [row["食材"] for row in request.get("食材リスト", [])] or ["ご飯"]
+    purpose = request.get("目的", "")
+    rng = seeded_random(json.dumps(request, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    dishes = []
+    for i in range(3):
+        #期限の早い食材から順に使う
+        main = names[i % len(names)]
+        sub = names[(i + 1) % len(names)]
+        style = rng.choice(DISH_STYLES)
+        used = sorted({main, sub})
+        dishes.append({
+            "dish": f"{purpose}の{'と'.join(used)}の{style}",
+            "ingredients": used + ["塩", "こしょう"],
+            "steps": [f"{'と'.join(used)}を食べやすい大きさに切る",
+                      f"{style}にして塩とこしょうで味を調える", "器に盛り付ける"],
+        })
+    return dishes
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """スタンドインサーバーのリクエストハンドラ
+
+    設定はクラス属性で持ち、start_serverでサーバーごとのサブクラスを作成して変更する
+
+    Attributes:
+        latency (float): 応答までの遅延秒数
+        jitter (float): 遅延に加える乱数の最大秒数
+        failure_rate (float): 503を返す確率
+        boxes (int): 画像一枚あたりの検出数
+        stream (bool): Acceptヘッダで要求された場合に料理の提案をNDJSONで返すかどうか
+        base_date (datetime.date): 期限の基準日（Noneの場合は今日）
+        rng (random.Random): 遅延と失敗の注入に使う乱数生成器
+    """
+    latency = 0.0
+    jitter = 0.0
+    failure_rate = 0.0
+    boxes = 3
+    stream = True
+    base_date = None
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+
+    def do_POST(self):
+        """POSTリクエストを処理するメソッド"""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.rng_lock:
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            failed = self.rng.random() < self.failure_rate
+        time.sleep(delay)
+        if failed:
+            self.send_json({"detail": "injected failure"}, status=503)
+            return
+
+        if self.path.startswith("/food-expiration"):
+            self.food_expiration(body)
+        elif self.path.startswith("/propose_dish"):
+            self.propose_dish(body)
+        else:
+            self.send_error(404)
+
+    def food_expiration(self, body):
+        """画像の検出結果を返すメソッド
+
+        "file"で一枚送られた場合は{"data": [...]}、"files"で複数枚送られた場合は{"results": [...]}を返す
+
+        Args:
+            body (bytes): multipart/form-dataのリクエストの本文
+        """
+        fields = parse_multipart(self.headers.get("Content-Type", ""), body)
+        base_date = self.base_date or datetime.date.today()
+        try:
+            results = [detect(data, self.boxes, base_date) for name, data in fields if name in ("file", "files")]
+        except Exception:
+            self.send_json({"detail": "invalid image"}, status=400)
+            return
+        if not results:
+            self.send_json({"detail": "file is required"}, status=400)
+        elif any(name == "files" for name, _ in fields):
+            self.send_json({"results": results})
+        else:
+            self.send_json(results[0])
+
+    def propose_dish(self, body):
+        """料理の提案を返すメソッド
+
+        AcceptヘッダにNDJSONが含まれる場合は料理ごとに分けて返す
+
+        Args:
+            body (bytes): JSONのリクエストの本文
+        """
+        try:
+            dishes = propose(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            self.send_json({"detail": "invalid request"}, status=400)
+            return
+        if not (self.stream and "application/x-ndjson" in self.headers.get("Accept", "")):
+            self.send_json({"Dishes": dishes})
+            return
+
+        #Content-Lengthを送らず、接続を閉じて応答の終わりを伝える
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for dish in dishes:
+            self.wfile.write(json.dumps(dish, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+        self.close_connection = True
+
+    def send_json(self, body, status=200):
+        """JSONの応答を送信するメソッド
+
+        Args:
+            body (dict): 応答データ
+            status (int): HTTPステータスコード
+        """
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        """アクセスログを出力しないためのメソッド"""
+
+
+def start_server(host="127.0.0.1", port=0, seed=0, **options):
+    """スタンドインサーバーを別スレッドで起動する関数
+
+    Args:
+        host (str): 待ち受けるホスト
+        port (int): 待ち受けるポート（0の場合は空いているポート）
+        seed (int): 遅延と失敗の注入に使う乱数の種
+        **options: StandinHandlerのクラス属性（latency, jitter, failure_rate, boxes, stream, base_date）
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー
+    """
+    handler = type("StandinHandler", (StandinHandler,), dict(options, rng=random.Random(seed)))
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="standin-server", daemon=True).start()
+    return server
+
+
+def run():
+    """引数を読み込み、スタンドインサーバーを起動する関数"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答までの遅延秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延に加える乱数の最大秒数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="503を返す確率")
+    parser.add_argument("--boxes", type=int, default=3, help="画像一枚あたりの検出数")
+    parser.add_argument("--seed", type=int, default=0, help="遅延と失敗の注入に使う乱数の種")
+    parser.add_argument("--no-stream", action="store_true", help="料理の提案をストリーミングで返さない")
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, seed=args.seed, latency=args.latency, jitter=args.jitter,
+                          failure_rate=args.failure_rate, boxes=args.boxes, stream=not args.no_stream)
+    print(f"standin server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    run()
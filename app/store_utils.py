@@ -0,0 +1,268 @@
+import hashlib
+import io
+import os
+import sqlite3
+from PIL import Image
+
+
+def encode_image(image, format="WEBP", quality=80):
+    """画像を保存用の形式でエンコードする関数
+
+    Args:
+        image (PIL.Image): 画像
+        format (str): エンコード形式（WEBP, JPEG, PNG）
+        quality (int): 非可逆圧縮の品質
+
+    Returns:
+        bytes: エンコードされた画像
+    """
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format, quality=quality)
+    return buf.getvalue()
+
+
+class DirectoryImageStore:
+    """商品の画像を{ID}.pngのファイルとしてディレクトリに保存するストア
+
+    Attributes:
+        image_dir (str): 画像を保存するディレクトリのパス
+    """
+    def __init__(self, image_dir):
+        """初期化メソッド
+
+        Args:
+            image_dir (str): 画像を保存するディレクトリのパス
+        """
+        self.image_dir = image_dir
+        os.makedirs(self.image_dir, exist_ok=True)
+
+    def path(self, id):
+        """画像ファイルのパスを取得するメソッド
+
+        Args:
+            id (int): 商品データのID
+
+        Returns:
+            str: 画像ファイルのパス
+        """
+        return os.path.join(self.image_dir, f"{id}.png")
+
+    def put(self, id, image):
+        """商品の画像を保存するメソッド
+
+        Args:
+            id (int): 商品データのID
+            image (PIL.Image): 画像
+        """
+        image.save(self.path(id), 'PNG')
+
+    def put_bytes(self, id, data):
+        """エンコード済みの画像をPNGに変換して保存するメソッド
+
+        Args:
+            id (int): 商品データのID
+            data (bytes): エンコードされた画像
+        """
+        with Image.open(io.BytesIO(data)) as image:
+            self.put(id, image)
+
+    def versions(self, ids):
+        """画像の版（内容が変わると変わる値）を取得するメソッド
+
+        Args:
+            ids (list): 商品データのID
+
+        Returns:
+            dict: IDごとの版。画像がないIDは含まない
+        """
+        versions = {}
+        for id in ids:
+            try:
+                versions[id] = os.stat(self.path(id)).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return versions
+
+    def load(self, id):
+        """エンコードされた画像を読み込むメソッド
+
+        Args:
+            id (int): 商品データのID
+
+        Returns:
+            bytes: エンコードされた画像。ない場合はNone
+        """
+        try:
+            with open(self.path(id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, ids):
+        """商品の画像を削除するメソッド
+
+        Args:
+            ids (list): 商品データのID
+        """
+        for id in ids:
+            image_path = self.path(id)
+            if os.path.exists(image_path):
+                os.remove(image_path)
+
+    def compact(self, vacuum_ratio=0.25):
+        """ストアを整理するメソッド（ファイルごとに保存するため何もしない）
+
+        Args:
+            vacuum_ratio (float): SQLiteImageStoreとの互換のための引数
+        """
+
+
+class SQLiteImageStore:
+    """商品の画像を内容のハッシュ値をキーにしてSQLiteに保存するストア
+
+    同じ内容の画像は一つだけ保存し、商品のIDからハッシュ値を参照する。
+    画像はサムネイル用の品質でエンコードして保存する。
+
+    Attributes:
+        pool (ConnectionPool): 画像用DBのコネクションプール
+        format (str): エンコード形式
+        quality (int): 非可逆圧縮の品質
+    """
+    def __init__(self, pool, format="WEBP", quality=80):
+        """初期化メソッド
+
+        Args:
+            pool (ConnectionPool): 画像用DBのコネクションプール
+            format (str): エンコード形式
+            quality (int): 非可逆圧縮の品質
+        """
+        self.pool = pool
+        self.format = format
+        self.quality = quality
+        with self.pool.connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS image_blobs(
+                            hash TEXT PRIMARY KEY,
+                            data BLOB
+                            )''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS product_images(
+                            product_id INTEGER PRIMARY KEY,
+                            hash TEXT NOT NULL
+                            )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_product_images_hash ON product_images(hash)")
+
+    def put(self, id, image):
+        """商品の画像を保存するメソッド
+
+        Args:
+            id (int): 商品データのID
+            image (PIL.Image): 画像
+        """
+        self.put_bytes(id, encode_image(image, self.format, self.quality))
+
+    def put_bytes(self, id, data):
+        """エンコード済みの画像を保存するメソッド
+
+        Args:
+            id (int): 商品データのID
+            data (bytes): エンコードされた画像
+        """
+        hash = hashlib.sha256(data).hexdigest()
+        with self.pool.connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO image_blobs (hash, data) VALUES (?, ?)",
+                         (hash, sqlite3.Binary(data)))
+            conn.execute("INSERT OR REPLACE INTO product_images (product_id, hash) VALUES (?, ?)",
+                         (id, hash))
+
+    def versions(self, ids):
+        """画像の版（内容のハッシュ値）をまとめて取得するメソッド
+
+        Args:
+            ids (list): 商品データのID
+
+        Returns:
+            dict: IDごとのハッシュ値。画像がないIDは含まない
+        """
+        ids = list(ids)
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" * len(ids))
+        rows = self.pool.connection().execute(
+            f"SELECT product_id, hash FROM product_images WHERE product_id IN ({placeholders})", ids
+        )
+        return {row["product_id"]: row["hash"] for row in rows}
+
+    def load(self, id):
+        """エンコードされた画像を読み込むメソッド
+
+        Args:
+            id (int): 商品データのID
+
+        Returns:
+            bytes: エンコードされた画像。ない場合はNone
+        """
+        row = self.pool.connection().execute(
+            '''SELECT b.data FROM product_images p JOIN image_blobs b ON p.hash = b.hash
+               WHERE p.product_id = ?''', (id,)
+        ).fetchone()
+        return bytes(row["data"]) if row else None
+
+    def delete(self, ids):
+        """商品の画像の参照を削除するメソッド
+
+        画像の本体は他の商品から参照されている可能性があるため、compactで削除する
+
+        Args:
+            ids (list): 商品データのID
+        """
+        with self.pool.connection() as conn:
+            conn.executemany("DELETE FROM product_images WHERE product_id = ?", [(id,) for id in ids])
+
+    def compact(self, vacuum_ratio=0.25):
+        """どの商品からも参照されていない画像を削除し、空きページが多い場合はDBファイルを縮小するメソッド
+
+        VACUUMはDB全体を書き直すため、空きページがvacuum_ratio以上になった場合だけ実行する
+
+        Args:
+            vacuum_ratio (float): VACUUMを実行する空きページの割合
+
+        Returns:
+            int: 削除した画像の数
+        """
+        conn = self.pool.connection()
+        with conn:
+            cursor = conn.execute('''DELETE FROM image_blobs WHERE hash NOT IN
+                                    (SELECT hash FROM product_images)''')
+            removed = cursor.rowcount
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        total_pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        if total_pages and free_pages >= total_pages * vacuum_ratio:
+            conn.execute("VACUUM")
+        return removed
+
+    def import_directory(self, image_dir):
+        """{ID}.pngのファイルで保存された画像をストアに移行するメソッド
+
+        移行したファイルは削除する
+
+        Args:
+            image_dir (str): 画像が保存されたディレクトリのパス
+
+        Returns:
+            int: 移行した画像の数
+        """
+        if not os.path.isdir(image_dir):
+            return 0
+
+        count = 0
+        for entry in os.scandir(image_dir):
+            name, ext = os.path.splitext(entry.name)
+            if ext != ".png" or not name.isdigit():
+                continue
+            with Image.open(entry.path) as img:
+                img.load()
+                self.put(int(name), img)
+            os.remove(entry.path)
+            count += 1
+        return count
@@ -0,0 +1,216 @@
+"""クライアントのDB処理・画像処理・HTTP通信のベンチマーク
+
+一時フォルダにDBを作成してN人×M件の商品データを登録し、各処理の時間を計測する。
+HTTP通信はローカルに起動したスタンドインサーバー（app/standin_server.py）に対して計測する。
+結果はJSONで出力し、CIで実行ごとの比較に使う。
+
+実行例:
+    python benchmarks/run_benchmarks.py --users 10 --products 500 --output bench.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def measure(fn, repeat, setup=None):
+    """処理時間を計測する関数
+
+    Args:
+        fn (callable): 計測する処理
+        repeat (int): 繰り返し回数
+        setup (callable): 各回の計測前に実行する処理（計測に含めない）
+
+    Returns:
+        dict: ミリ秒単位の最小・中央値・平均・最大と繰り返し回数
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "repeat": repeat,
+        "min_ms": min(times),
+        "median_ms": statistics.median(times),
+        "mean_ms": statistics.mean(times),
+        "max_ms": max(times),
+    }
+
+
+def synthetic_jpeg(width, height):
+    """ベンチマーク用のJPEG画像を作成する関数
+
+    Args:
+        width (int): 幅
+        height (int): 高さ
+
+    Returns:
+        bytes: JPEG画像
+    """
+    from PIL import Image
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def named_file(name, data):
+    """バイト列をファイル名付きのファイルオブジェクトに変換する関数
+
+    Args:
+        name (str): ファイル名
+        data (bytes): バイト列
+
+    Returns:
+        io.BytesIO: ファイルオブジェクト
+    """
+    f = io.BytesIO(data)
+    f.name = name
+    return f
+
+
+def bench_db(db_dir, args):
+    """DB処理のベンチマーク"""
+    import db_utils
+    from expiry_utils import products_frame, add_expiry_status
+
+    db = db_utils.DatabaseManager(db_dir)
+    db.create()
+    today = datetime.date.today()
+    rng = random.Random(0)
+    users = [f"user{u}" for u in range(args.users)]
+
+    def rows():
+        return [(f"item{i}", rng.choice(["消費期限", "賞味期限"]), today + datetime.timedelta(days=rng.randint(-10, 30)))
+                for i in range(args.products)]
+
+    results = {}
+    start = time.perf_counter()
+    for user in users:
+        db.insert_many(user, rows())
+    results["seed_insert_many_ms"] = (time.perf_counter() - start) * 1000
+
+    target = users[0]
+    results["insert"] = measure(lambda: db.insert(target, "single", "消費期限", today), args.repeat)
+    results["insert_many_30"] = measure(lambda: db.insert_many(target, rows()[:30]), args.repeat)
+    results["fetch_all_products_cold"] = measure(
+        lambda: db.fetch_all_products(target), args.repeat,
+        setup=lambda: db_utils._product_cache.invalidate((db.db_path, target)))
+    results["fetch_all_products_warm"] = measure(lambda: db.fetch_all_products(target), args.repeat)
+    results["fetch_products_page"] = measure(lambda: db.fetch_products(target, 20, ("2000-01-01", 0)), args.repeat)
+
+    products = db.fetch_all_products(target)
+    results["expiry_status"] = measure(lambda: add_expiry_status(products_frame(products)), args.repeat)
+
+    def delete_batch():
+        future = db.delete_many([row["id"] for row in db.fetch_products(target, 30)])
+        if future:
+            future.result()
+    results["delete_many_30"] = measure(delete_batch, args.repeat)
+    results["rows_per_user"] = len(db.fetch_all_products(target))
+    return results
+
+
+def bench_images(args):
+    """画像処理のベンチマーク"""
+    from image_utils import ImageProcessor
+
+    data = synthetic_jpeg(args.image_width, args.image_height)
+    rng = random.Random(0)
+    boxes = []
+    for _ in range(args.boxes):
+        x, y = rng.randint(0, args.image_width - 600), rng.randint(0, args.image_height - 600)
+        boxes.append((x, y, x + rng.randint(200, 600), y + rng.randint(200, 600)))
+
+    return {
+        "image_size": [args.image_width, args.image_height],
+        "boxes": args.boxes,
+        "crop_squares": measure(lambda: ImageProcessor.crop_squares(io.BytesIO(data), boxes), args.repeat),
+    }
+
+
+def bench_http(db_dir, args):
+    """HTTP通信のベンチマーク（スタンドインサーバーに対して計測）"""
+    import main
+    from image_utils import ImageUploader, detection_cache
+    from chat_utils import DishProposer, Ingredient, Ingredients
+    import db_utils
+
+    data = synthetic_jpeg(args.image_width, args.image_height)
+    image = named_file("bench.jpg", data)
+    uploader = ImageUploader(image)
+    key = uploader.cache_key()
+    app = main.App(db_utils.DatabaseManager(db_dir), db_utils.UserManager(db_dir))
+
+    ingredients = Ingredients(
+        食材リスト=[Ingredient(食材=f"item{i}", 期限種類="消費期限", 期限="2030-01-01") for i in range(30)],
+        目的="夕食",
+    )
+    return {
+        "image_upload_uncached": measure(lambda: ImageUploader(named_file("bench.jpg", data)).upload(), args.repeat,
+                                         setup=lambda: detection_cache.invalidate(key)),
+        "image_upload_cached": measure(lambda: ImageUploader(named_file("bench.jpg", data)).upload(), args.repeat),
+        "make_input_data": measure(
+            lambda: app.make_input_data(named_file("bench.jpg", data), ImageUploader(named_file("bench.jpg", data)).upload()),
+            args.repeat),
+        "dish_proposal_upload": measure(lambda: DishProposer().upload(ingredients), args.repeat),
+    }
+
+
+def run():
+    """引数を読み込み、すべてのベンチマークを実行する関数"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5, help="登録するユーザ数")
+    parser.add_argument("--products", type=int, default=300, help="ユーザごとの商品数")
+    parser.add_argument("--repeat", type=int, default=10, help="各処理の繰り返し回数")
+    parser.add_argument("--boxes", type=int, default=20, help="切り出す座標の数")
+    parser.add_argument("--image-width", type=int, default=4000)
+    parser.add_argument("--image-height", type=int, default=3000)
+    parser.add_argument("--shards", type=int, default=1, help="商品データのDBファイルの数（0: ユーザごと）")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル（省略時は標準出力）")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+    import standin_server
+    server = standin_server.start_server(boxes=args.boxes, base_date=datetime.date(2030, 1, 1))
+    os.environ["SERVER_IP"] = f"127.0.0.1:{server.server_address[1]}"
+    os.environ["DB_SHARDS"] = str(args.shards)
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        results = {
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "users": args.users,
+                "products": args.products,
+                "shards": args.shards,
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            },
+            "db": bench_db(db_dir, args),
+            "images": bench_images(args),
+            "http": bench_http(db_dir, args),
+        }
+    server.shutdown()
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    run()
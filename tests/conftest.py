@@ -0,0 +1,6 @@
+import os
+import sys
+
+# appフォルダのモジュールを読み込めるようにする（configは読み込み時にSERVER_IPを必要とする）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+os.environ.setdefault("SERVER_IP", "127.0.0.1:9")
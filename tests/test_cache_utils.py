@@ -0,0 +1,56 @@
+"""SingleFlightが同じキーの呼び出しをまとめることを確認するテスト"""
+import threading
+import time
+
+from cache_utils import SingleFlight
+
+
+def slow_items(calls, started, release):
+    """呼び出し回数を数え、releaseが設定されるまで要素を返すのを待つ関数"""
+    calls.append(1)
+    started.set()
+    yield 1
+    release.wait(5)
+    yield 2
+
+
+def run_in_thread(fn):
+    """fnを別スレッドで実行し、結果を受け取るリストとスレッドを返す関数"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()))
+    thread.start()
+    return result, thread
+
+
+def test_followers_wait_for_streaming_leader():
+    flight = SingleFlight()
+    calls, started, release = [], threading.Event(), threading.Event()
+    leader = flight.stream("key", lambda: slow_items(calls, started, release))
+    assert next(leader) == 1
+    started.wait(5)
+
+    streamed, stream_thread = run_in_thread(lambda: list(flight.stream("key", lambda: iter([9]))))
+    done, do_thread = run_in_thread(lambda: flight.do("key", lambda: [9]))
+    time.sleep(0.1)
+    assert not streamed and not done
+
+    release.set()
+    assert list(leader) == [2]
+    stream_thread.join(5)
+    do_thread.join(5)
+    assert streamed == [[1, 2]]
+    assert done == [[1, 2]]
+    assert len(calls) == 1
+
+
+def test_abandoned_stream_lets_follower_run():
+    flight = SingleFlight()
+    calls, started, release = [], threading.Event(), threading.Event()
+    leader = flight.stream("key", lambda: slow_items(calls, started, release))
+    assert next(leader) == 1
+
+    done, thread = run_in_thread(lambda: flight.do("key", lambda: "own"))
+    time.sleep(0.1)
+    leader.close()
+    thread.join(5)
+    assert done == ["own"]
@@ -0,0 +1,48 @@
+"""ユーザの削除で商品データ・画像・通知が残らないことを確認するテスト"""
+import datetime
+
+from db_utils import DatabaseManager
+from notify_utils import ExpiryScheduler, LogSink
+
+
+def make_db(tmp_path):
+    """一時フォルダにデータベースを作成する関数"""
+    db = DatabaseManager(str(tmp_path))
+    db.user_db.create(make_init_user=False)
+    db.create()
+    return db
+
+
+def test_delete_user_removes_products_images_and_cache(tmp_path):
+    db = make_db(tmp_path)
+    id = db.insert("alice", "milk", "消費期限", "2030-01-02")
+    db.insert("bob", "egg", "賞味期限", "2030-01-03")
+    db.image_store.put_bytes(id, b"image")
+    assert len(db.fetch_all_products("alice")) == 1
+
+    db.delete_user_products("alice")
+    db.user_db.delete("alice")
+    db.cleanup_images()
+    assert db.fetch_all_products("alice") == []
+    assert db.image_store.load(id) is None
+    assert [row["item_name"] for row in db.fetch_all_products("bob")] == ["egg"]
+
+    #同じ名前で登録し直しても以前の商品は表示されない
+    db.user_db.register("alice")
+    assert db.fetch_all_products("alice") == []
+
+
+def test_digests_are_grouped_by_user_id(tmp_path):
+    db = make_db(tmp_path)
+    db.insert("alice", "milk", "消費期限", "2030-01-01")
+    db.insert("alice", "egg", "賞味期限", "2030-01-02")
+    db.insert("bob", "bread", "消費期限", "2030-01-01")
+    #削除済みのユーザの商品が残っていても通知しない
+    with db.connect() as conn:
+        conn.execute('''INSERT INTO product (user_id, user_name, item_name, expiry_type, expiry_date)
+                        VALUES (999, 'alice', 'orphan', '消費期限', '2030-01-01')''')
+
+    digests = ExpiryScheduler(db, LogSink()).digests(datetime.date(2030, 1, 1))
+    items = {digest["user"]: [item["item_name"] for status in ("today", "soon") for item in digest[status]]
+             for digest in digests}
+    assert items == {"alice": ["milk", "egg"], "bob": ["bread"]}
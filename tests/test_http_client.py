@@ -0,0 +1,122 @@
+"""HttpClientのタイムアウト・リトライ・サーキットブレーカーをスタンドインサーバーに対して確認するテスト"""
+import io
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+from PIL import Image
+
+import standin_server
+from http_client import CircuitOpenError, HttpClient
+
+
+class CountingHandler(standin_server.StandinHandler):
+    """受け取ったリクエスト数を数え、statusが設定されていればその応答を返すハンドラ"""
+    status = None
+    count = 0
+    count_lock = threading.Lock()
+
+    def do_POST(self):
+        """リクエスト数を数えてから応答するメソッド"""
+        with self.count_lock:
+            type(self).count += 1
+        if self.status:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json({"detail": "injected"}, status=self.status)
+            return
+        super().do_POST()
+
+
+@pytest.fixture
+def server():
+    """テストごとに設定を変更できるスタンドインサーバーを起動するフィクスチャ"""
+    handler = type("Handler", (CountingHandler,), {"count": 0})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path="/food-expiration/"):
+    """サーバーのURLを作成する関数"""
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def image_file():
+    """送信用の画像ファイルを作成する関数"""
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(buf, "JPEG")
+    return {"file": ("a.jpg", buf.getvalue(), "image/jpeg")}
+
+
+def test_success(server):
+    client = HttpClient({"food-expiration": (1, 5)}, retries=0)
+    response = client.post("food-expiration", url(server), files=image_file())
+    assert len(response.json()["data"]) == 3
+
+
+def test_read_timeout_is_not_retried(server):
+    server.RequestHandlerClass.latency = 0.5
+    client = HttpClient({"food-expiration": (1, 0.1)}, retries=2, backoff_factor=0)
+    start = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        client.post("food-expiration", url(server), files=image_file())
+    assert time.monotonic() - start < 0.5
+    time.sleep(0.6)
+    assert server.RequestHandlerClass.count == 1
+
+
+def test_503_is_retried_a_bounded_number_of_times(server):
+    server.RequestHandlerClass.failure_rate = 1.0
+    client = HttpClient({"food-expiration": (1, 5)}, retries=2, backoff_factor=0)
+    with pytest.raises(requests.HTTPError) as e:
+        client.post("food-expiration", url(server), files=image_file())
+    assert e.value.response.status_code == 503
+    assert server.RequestHandlerClass.count == 3
+
+
+def test_504_is_not_retried(server):
+    server.RequestHandlerClass.status = 504
+    client = HttpClient({"food-expiration": (1, 5)}, retries=2, backoff_factor=0)
+    with pytest.raises(requests.HTTPError):
+        client.post("food-expiration", url(server), files=image_file())
+    assert server.RequestHandlerClass.count == 1
+
+
+def test_circuit_opens_and_closes(server):
+    server.RequestHandlerClass.failure_rate = 1.0
+    client = HttpClient({"food-expiration": (1, 5)}, retries=0, failure_threshold=2, reset_timeout=0.2)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.post("food-expiration", url(server), files=image_file())
+    assert not client.available("food-expiration")
+
+    #開いている間はサーバーに送信しない
+    with pytest.raises(CircuitOpenError):
+        client.post("food-expiration", url(server), files=image_file())
+    assert server.RequestHandlerClass.count == 2
+
+    #reset_timeout経過後の試行が成功すると閉じる
+    server.RequestHandlerClass.failure_rate = 0.0
+    time.sleep(0.25)
+    client.post("food-expiration", url(server), files=image_file())
+    assert client.available("food-expiration")
+
+
+def test_connection_error_opens_circuit():
+    client = HttpClient({"food-expiration": (0.2, 1)}, retries=0, failure_threshold=1)
+    with pytest.raises(requests.ConnectionError):
+        client.post("food-expiration", "http://127.0.0.1:9/food-expiration/", files=image_file())
+    assert not client.available("food-expiration")
+
+
+def test_client_errors_do_not_open_circuit(server):
+    client = HttpClient({"food-expiration": (1, 5)}, retries=0, failure_threshold=2)
+    for _ in range(5):
+        with pytest.raises(requests.HTTPError) as e:
+            client.post("food-expiration", url(server), files={"file": ("a.jpg", b"not an image", "image/jpeg")})
+        assert e.value.response.status_code == 400
+    assert client.available("food-expiration")
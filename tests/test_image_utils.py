@@ -0,0 +1,52 @@
+"""ImageProcessor.crop_squaresが元画像の座標どおりに切り出すことを確認するテスト"""
+import io
+
+import pytest
+from PIL import Image, ImageChops, ImageOps, ImageStat
+
+from image_utils import EXIF_ORIENTATION, ImageProcessor
+
+
+def gradient_jpeg(width, height, orientation=1):
+    """縦横で色が変わるJPEGを作成する関数（orientationはEXIFの向き）"""
+    x = Image.linear_gradient("L").transpose(Image.Transpose.ROTATE_90).resize((width, height))
+    y = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (x, y, ImageChops.invert(x)))
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = orientation
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=95, exif=exif)
+    return buf.getvalue()
+
+
+def mean_difference(a, b):
+    """二つの画像の画素値の差の平均を求める関数"""
+    return sum(ImageStat.Stat(ImageChops.difference(a, b)).mean) / 3
+
+
+@pytest.mark.parametrize("size", [(800, 600), (4032, 3024)])
+@pytest.mark.parametrize("orientation", [1, 6, 8])
+def test_crop_squares_matches_full_resolution_crop(size, orientation):
+    data = gradient_jpeg(*size, orientation)
+    full = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    boxes = [(0, 0, 300, 300), (full.width - 700, full.height - 500, full.width, full.height)]
+
+    crops = ImageProcessor.crop_squares(io.BytesIO(data), boxes)
+    for box, crop in zip(boxes, crops):
+        expected = ImageProcessor(full.crop(box)).square().image
+        assert crop.size == expected.size
+        assert mean_difference(crop.convert("RGB"), expected.convert("RGB")) < 4
+
+
+@pytest.mark.parametrize("size", [(4033, 3025), (4001, 3001)])
+def test_crop_squares_keeps_resolution_for_odd_sizes(size):
+    #細かい模様は余分に縮小すると失われるため、差が大きくなる
+    img = Image.effect_noise(size, 100).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=95)
+    full = Image.open(io.BytesIO(buf.getvalue()))
+    box = (1000, 1000, 1300, 1300)
+
+    crop = ImageProcessor.crop_squares(io.BytesIO(buf.getvalue()), [box])[0]
+    expected = ImageProcessor(full.crop(box)).square().image
+    assert mean_difference(crop.convert("RGB"), expected.convert("RGB")) < 20
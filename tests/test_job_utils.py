@@ -0,0 +1,38 @@
+"""JobQueueが取り出されないジョブを破棄することを確認するテスト"""
+import time
+
+from job_utils import JobQueue
+
+
+def test_uncollected_jobs_expire():
+    queue = JobQueue(max_workers=1, result_ttl=0.1)
+    abandoned = queue.submit(lambda: "abandoned")
+    while not queue.done(abandoned):
+        time.sleep(0.01)
+    time.sleep(0.15)
+
+    kept = queue.submit(lambda: "kept")
+    assert queue.pop(abandoned) is None
+    while not queue.done(kept):
+        time.sleep(0.01)
+    assert queue.pop(kept).result() == "kept"
+
+
+def test_running_jobs_are_not_expired():
+    queue = JobQueue(max_workers=1, result_ttl=0)
+    running = queue.submit(time.sleep, 0.2)
+    queue.submit(lambda: None)
+    assert not queue.done(running)
+    while not queue.done(running):
+        time.sleep(0.01)
+    assert queue.pop(running) is not None
+
+
+def test_polled_jobs_are_kept():
+    queue = JobQueue(max_workers=1, result_ttl=0.1)
+    polled = queue.submit(lambda: "polled")
+    for _ in range(3):
+        time.sleep(0.06)
+        assert queue.done(polled)
+        queue.submit(lambda: None)
+    assert queue.pop(polled).result() == "polled"
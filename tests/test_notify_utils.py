@@ -0,0 +1,37 @@
+"""ExpirySchedulerが再起動後に同じ日の通知を送り直さないことを確認するテスト"""
+import datetime
+
+from db_utils import DatabaseManager
+from notify_utils import ExpiryScheduler
+
+
+class ListSink:
+    """通知をリストに保存する通知先"""
+
+    def __init__(self):
+        self.digests = []
+
+    def emit(self, digest):
+        self.digests.append(digest)
+
+
+def test_digests_are_sent_once_per_day_across_restarts(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    db.create()
+    db.insert("alice", "milk", "消費期限", "2030-01-02")
+    sink = ListSink()
+    morning = datetime.datetime(2030, 1, 1, 7)
+    notify_at = datetime.datetime(2030, 1, 1, 8)
+
+    assert ExpiryScheduler(db, sink).run_once(morning) == notify_at
+    assert sink.digests == []
+
+    ExpiryScheduler(db, sink).run_once(notify_at)
+    assert [digest["date"] for digest in sink.digests] == ["2030-01-01"]
+
+    #再起動した（新しいインスタンスの）スケジューラは同じ日の通知を送らない
+    ExpiryScheduler(db, sink).run_once(notify_at + datetime.timedelta(hours=3))
+    assert len(sink.digests) == 1
+
+    ExpiryScheduler(db, sink).run_once(notify_at + datetime.timedelta(days=1))
+    assert [digest["date"] for digest in sink.digests] == ["2030-01-01", "2030-01-02"]
@@ -0,0 +1,46 @@
+"""SQLiteImageStoreのcompactが参照されない画像を削除し、必要な場合だけ縮小することを確認するテスト"""
+import os
+
+from db_utils import ConnectionPool
+from store_utils import SQLiteImageStore
+
+
+def make_store(tmp_path):
+    """一時フォルダに画像のストアを作成する関数"""
+    return SQLiteImageStore(ConnectionPool(str(tmp_path / "images.db")))
+
+
+def blob_count(store):
+    """保存されている画像の本体の数を取得する関数"""
+    return store.pool.connection().execute("SELECT COUNT(*) FROM image_blobs").fetchone()[0]
+
+
+def free_pages(store):
+    """DBの空きページ数を取得する関数"""
+    return store.pool.connection().execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def test_compact_removes_only_unreferenced_blobs(tmp_path):
+    store = make_store(tmp_path)
+    store.put_bytes(1, b"shared")
+    store.put_bytes(2, b"shared")
+    store.put_bytes(3, b"only")
+    store.delete([1, 3])
+    assert store.compact() == 1
+    assert blob_count(store) == 1
+    assert store.load(2) == b"shared"
+
+
+def test_compact_vacuums_only_when_many_pages_are_free(tmp_path):
+    store = make_store(tmp_path)
+    for id in range(20):
+        store.put_bytes(id, os.urandom(8192))
+
+    #空きページが少ない場合は縮小しない
+    store.delete([0])
+    store.compact(vacuum_ratio=0.5)
+    assert free_pages(store) > 0
+
+    store.delete(range(1, 15))
+    store.compact(vacuum_ratio=0.5)
+    assert free_pages(store) == 0